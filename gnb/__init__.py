@@ -21,4 +21,15 @@ __description__     = "Build metadata tables for NCBI biosample/SRA submission"
 __download_url__    = "https://github.com/schultzm/gnb.git"
 __author__          = "Mark B Schultz"
 __author_email__    = "dr.mark.schultz@gmail.com"
-__license__         = "AGPL-3.0"
\ No newline at end of file
+__license__         = "AGPL-3.0"
+
+
+def resource_filename(name):
+    """Path of the packaged file name, e.g. __test_NCBI_up__."""
+    try:
+        from importlib.resources import files
+    except ImportError:
+        # importlib.resources.files is new in Python 3.9
+        from pkg_resources import resource_filename
+        return resource_filename(__parent_dir__, name)
+    return str(files(__parent_dir__) / name)
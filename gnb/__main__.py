@@ -18,9 +18,14 @@ Also, use this for creating the SRA table upload. This will output a TSV
 def main():
     
     """Perform the main routine."""
-    import argparse
-    from pathlib import Path, PurePath
     import sys
+    if sys.argv[1:] == ["version"]:
+        # answered before building the parser, for scripts calling gnb often
+        from . import __version__
+        print(__version__)
+        return
+    import argparse
+    from pathlib import Path
 
     parser = argparse.ArgumentParser(
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -30,50 +35,277 @@ def main():
     subparser1_args = argparse.ArgumentParser(add_help=False)
     subparser1_args.add_argument("NCBI_upload", help="NCBI template")
     subparser1_args.add_argument("GISAID_upload", help="metadata file uploaded to GISAID (csv or excel)")
-    subparser1_args.add_argument("GISAID_json", help="""json metadata.json.bz2
-                                 format""")
+    subparser1_args.add_argument("GISAID_json", help="""json metadata.json
+                                 download (bz2, gzip, xz, zstd, tar or
+                                 plain)""")
     subparser1_args.add_argument("BioProject", help="""NCBI bioproject
                                  accession.""")
-    subparser1_args.add_argument("-r", "--replacement", help="""Missing value
-                                 replacement string.  """, default="missing",
-                                 choices=["not collected", "not applicable",
-                                          "missing"],
-                                 type=str, required=False)
-    subparser1_args.add_argument("-b", "--bzgrep_regex", help="""Regex to
-                                 pre-filter gisaid.json.bz2 file to decrease
-                                 processing time.""",
-                                 type=str, required=False,
-                                 default='Australia|Timor\-Leste|Oceania')
     subparser2_args = argparse.ArgumentParser(add_help=False)
     subparser2_args.add_argument("BioSample_attributes", help="BioSample attributes.tsv")
     subparser2_args.add_argument("GISAID_upload", help="metadata file uploaded to GISAID (csv or excel)")
     subparser2_args.add_argument("SRA_template", help="SRA_metadata_acc.xlsx") #Must save spreadsheet under second tab (SRA_data) as a TSV (tab-delimited file) to upload the TSV file for the SRA metadata tab.
+    subparser2_args.add_argument("-u", "--unmatched", help="""Write the
+                                 virus names found in only one of
+                                 GISAID_upload and BioSample_attributes to
+                                 this tab-delimited file.""",
+                                 required=False)
     subparser3_args = argparse.ArgumentParser(add_help=False)
     subparser3_args.add_argument("GISAID_json", help="""json metadata.json.bz2
                                  format""") #perhaps this should be removed and subparser1 used instead
+    subparser3_args.add_argument("-k", "--keep", help="""Columns to keep in
+                                 the output table (covv_virus_name is always
+                                 kept).  Only these fields are read from each
+                                 record.  For more than one column, use the -k
+                                 option again.""",
+                                 action="append", required=False)
     subparser4_args = argparse.ArgumentParser(add_help=False)
     subparser4_args.add_argument("-d", "--drop", help="""Columns to drop
                                  from output table.  For more than one column,
                                  use the -d option again. For column names
                                  containing spaces, escape the space with
                                  a backslash.""",
+                                 action="append", required=False)
+    subparser4_args.add_argument("-t", "--threads", help="""Number of cores
+                                 used to decompress GISAID_json.""",
+                                 type=int, required=False, default=1)
+    subparser4_args.add_argument("-j", "--parse_workers", help="""Number of
+                                 processes parsing and filtering the
+                                 decompressed GISAID_json records.""",
+                                 type=int, required=False, default=1)
+    subparser4_args.add_argument("--cache", help="""Keep the parsed
+                                 GISAID_json (requires pyarrow) in .gnb_cache
+                                 next to GISAID_json, and read it from there
+                                 on later runs with the same arguments.""",
+                                 action="store_true", required=False)
+    subparser4_args.add_argument("--cache_dir", help="""Directory for the
+                                 parsed GISAID_json cache.  Implies
+                                 --cache.""",
+                                 required=False)
+    subparser4_args.add_argument("--cache_entries", help="""Number of
+                                 parsed GISAID_json tables kept in the cache,
+                                 least recently used dropped first.""",
+                                 type=int, required=False, default=8)
+    subparser4_args.add_argument("--refresh-cache", help="""Re-parse
+                                 GISAID_json and overwrite its cache entry.  Implies
+                                 --cache.""",
+                                 action="store_true", required=False)
+    subparser6_args = argparse.ArgumentParser(add_help=False)
+    subparser6_args.add_argument("index", help="""Accession index (SQLite
+                                 file, created if missing).""")
+    subparser6_args.add_argument("GISAID_json", nargs="+", help="""json
+                                 metadata.json.bz2 format""")
+    subparser6_args.add_argument("-t", "--threads", help="""Number of cores
+                                 used to decompress GISAID_json.""",
+                                 type=int, required=False, default=1)
+    subparser7_args = argparse.ArgumentParser(add_help=False)
+    subparser7_args.add_argument("-r", "--replacement", help="""Missing value
+                                 replacement string.  """, default="missing",
+                                 choices=["not collected", "not applicable",
+                                          "missing"],
+                                 type=str, required=False)
+    subparser7_args.add_argument("-b", "--bzgrep_regex", help="""Regex to
+                                 pre-filter gisaid.json.bz2 file to decrease
+                                 processing time.""",
+                                 type=str, required=False,
+                                 default='Australia|Timor\-Leste|Oceania')
+    subparser7_args.add_argument("-p", "--prefilter", help="""Match
+                                 bzgrep_regex against each raw json line and
+                                 only parse the lines that hit.  Applies with
+                                 --match_field, or when bzgrep_regex is an
+                                 alternation of plain words like the
+                                 default; otherwise every line is parsed.""",
+                                 action="store_true", required=False)
+    subparser7_args.add_argument("-m", "--match_field", help="""Only match
+                                 bzgrep_regex against this json field (e.g.,
+                                 covv_location).  For more than one field, use
+                                 the -m option again.""",
+                                 action="append", required=False)
+    subparser7_args.add_argument("-i", "--index", help="""Look up GISAID
+                                 accessions in this accession index (see gnb
+                                 index) instead of parsing GISAID_json.
+                                 GISAID_json is added to the index first if
+                                 it has not been indexed.""",
+                                 required=False)
+    subparser8_args = argparse.ArgumentParser(add_help=False)
+    subparser8_args.add_argument("NCBI_upload", help="NCBI template")
+    subparser8_args.add_argument("GISAID_json", help="""json metadata.json.bz2
+                                 format""")
+    subparser8_args.add_argument("manifest", help="""Tab-delimited file with
+                                 columns GISAID_upload, BioProject and output,
+                                 one row per upload sheet.  Relative paths are
+                                 relative to the manifest.""")
+    subparser8_args.add_argument("-w", "--workers", help="""Number of upload
+                                 sheets merged at once.""",
+                                 type=int, required=False, default=1)
+    subparser9_args = argparse.ArgumentParser(add_help=False)
+    subparser9_args.add_argument("-s", "--sizes", help="""Numbers of GISAID_json
+                                 records to benchmark.""",
+                                 nargs="+", type=int, required=False,
+                                 default=[10000, 1000000, 10000000])
+    subparser9_args.add_argument("--stages", help="""Stages to benchmark.""",
+                                 nargs="+", required=False,
+                                 choices=["gisaid_json", "merge_biosample_dfs",
+                                          "sra_builder"],
+                                 default=["gisaid_json", "merge_biosample_dfs",
+                                          "sra_builder"])
+    subparser9_args.add_argument("-w", "--workdir", help="""Directory for the
+                                 generated inputs, which are reused by later
+                                 runs.""",
+                                 required=False, default="gnb_bench")
+    subparser9_args.add_argument("--seed", help="""Seed of the synthetic
+                                 data.""",
+                                 type=int, required=False, default=0)
+    subparser9_args.add_argument("--tracemalloc", help="""Run each stage again
+                                 under tracemalloc and report its peak
+                                 allocation.""",
+                                 action="store_true", required=False)
+    subparser9_args.add_argument("-o", "--output", help="""Write the JSON
+                                 results to this path instead of stdout.""",
+                                 required=False)
+    subparser10_args = argparse.ArgumentParser(add_help=False)
+    subparser10_args.add_argument("--profile", help="""Report the wall time,
+                                  CPU time, peak memory and record count of
+                                  each stage.  Printed to stderr, or written
+                                  as JSON to PROFILE if given.""",
+                                  nargs="?", const="-", required=False)
+    subparser10_args.add_argument("--profile_stage", help="""Run this stage
+                                  (e.g., gisaid_json) under --profile_hook and
+                                  print the result to stderr.  Implies
+                                  --profile.""",
+                                  required=False)
+    subparser10_args.add_argument("--profile_hook", help="""Profiler for
+                                  --profile_stage.""",
+                                  choices=["cprofile", "tracemalloc"],
+                                  default="cprofile", required=False)
+    subparser11_args = argparse.ArgumentParser(add_help=False)
+    subparser11_args.add_argument("NCBI_upload", help="NCBI template")
+    subparser11_args.add_argument("GISAID_json", help="""json
+                                  metadata.json.bz2 format""")
+    subparser11_args.add_argument("-s", "--SRA_template", help="""SRA
+                                  template (SRA_metadata_acc.xlsx), to also
+                                  serve merge_sra.""",
+                                  required=False)
+    subparser11_args.add_argument("--host", help="""Address to listen on.""",
+                                  required=False, default="127.0.0.1")
+    subparser11_args.add_argument("--port", help="""Port to listen on.""",
+                                  type=int, required=False, default=8000)
+    subparser11_args.add_argument("--socket", help="""Listen on this Unix
+                                  socket instead of host:port.""",
+                                  required=False)
+    subparser11_args.add_argument("-v", "--verbose", help="""Log each
+                                  request to stderr.""",
+                                  action="store_true", required=False)
+    subparser12_args = argparse.ArgumentParser(add_help=False)
+    subparser12_args.add_argument("--max-memory", help="""Parse GISAID_json
+                                  out of core, holding about this much of it
+                                  in memory (e.g., 512M, 4G) and spilling the
+                                  rest to disk.""",
+                                  dest="max_memory", required=False)
+    subparser12_args.add_argument("--spill_dir", help="""Directory for the
+                                  --max-memory partitions, which each run
+                                  keeps in a subdirectory of its own.
+                                  Defaults to the system temporary
+                                  directory.""",
+                                  required=False)
+    subparser13_args = argparse.ArgumentParser(add_help=False)
+    subparser13_args.add_argument("--ledger", help="""Submission ledger
+                                  (SQLite file, created if missing) recording
+                                  the rows written and, from merge_sra's
+                                  BioSample_attributes, the BioSamples NCBI
+                                  accepted.""",
+                                  required=False)
+    subparser13_args.add_argument("--since-ledger", help="""Only build and
+                                  write the rows that are new or changed since
+                                  they were recorded in --ledger.""",
+                                  dest="since_ledger", action="store_true",
+                                  required=False)
+    subparser14_args = argparse.ArgumentParser(add_help=False)
+    subparser14_args.add_argument("GISAID_json", help="""json metadata
+                                  download (bz2, gzip, xz, zstd, tar or
+                                  plain)""")
+    subparser14_args.add_argument("output", help="""Seekable zstd file to
+                                  write (e.g., metadata.json.zst).""")
+    subparser14_args.add_argument("--frame_size", help="""Decompressed size of
+                                  each zstd frame (e.g., 1M).  Smaller frames
+                                  give finer random access and work
+                                  splitting.""",
+                                  required=False, default="1M")
+    subparser14_args.add_argument("-l", "--level", help="""zstd compression
+                                  level.""",
+                                  type=int, required=False, default=3)
+    subparser14_args.add_argument("-t", "--threads", help="""Number of cores
+                                  used to decompress GISAID_json.""",
+                                  type=int, required=False, default=1)
+    subparser5_args = argparse.ArgumentParser(add_help=False)
+    subparser5_args.add_argument("-o", "--output", help="""Write the table to
+                                 this path instead of stdout.  Gzipped if the
+                                 path ends in .gz.""",
                                  required=False)
+    subparser5_args.add_argument("-z", "--gzip", help="""Gzip the output.""",
+                                 action="store_true", required=False)
+    subparser5_args.add_argument("--buffer_size", help="""Number of rows
+                                 rendered per write.""",
+                                 type=int, required=False, default=1000)
     subparser_modules = parser.add_subparsers(
         title="Sub-commands help", help="", metavar="", dest="subparser_name")
     subparser_modules.add_parser(
         "merge_bsmp", help="Merge metadata for SARS-CoV-2 NCBI BioSample submission.",
         description="Merge metadata for SARS-CoV-2 NCBI BioSample submission.",
-        parents=[subparser1_args, subparser4_args],
+        parents=[subparser1_args, subparser7_args, subparser4_args,
+                 subparser12_args, subparser13_args, subparser5_args,
+                 subparser10_args],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparser_modules.add_parser(
+        "merge_batch", help="""Merge metadata for SARS-CoV-2 NCBI BioSample
+                            submission for each upload sheet in a manifest.""",
+        description="""Merge metadata for SARS-CoV-2 NCBI BioSample submission
+                    for each upload sheet in a manifest, loading GISAID_json
+                    and NCBI_upload once.""",
+        parents=[subparser8_args, subparser7_args, subparser4_args,
+                 subparser10_args],
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     subparser_modules.add_parser(
         "merge_sra", help="Merge metadata for SARS-CoV-2 NCBI SRA submission.",
         description="Merge metadata for SARS-CoV-2 NCBI SRA submission.",
-        parents=[subparser2_args],
+        parents=[subparser2_args, subparser13_args, subparser5_args,
+                 subparser10_args],
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     subparser_modules.add_parser(
         "view_gsd", help="View the GISAID_json as a tab-delimited table.",
         description="Get tab-delimited format of GISAID_json",
-        parents=[subparser3_args, subparser4_args],
+        parents=[subparser3_args, subparser4_args, subparser5_args,
+                 subparser10_args],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparser_modules.add_parser(
+        "index", help="Add GISAID_json downloads to an accession index.",
+        description="""Add GISAID_json downloads to an accession index of
+                    virus names, accessions and record offsets.""",
+        parents=[subparser6_args, subparser10_args],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparser_modules.add_parser(
+        "convert", help="""Re-encode GISAID_json as seekable zstd.""",
+        description="""Re-encode GISAID_json as seekable zstd (requires
+                    zstandard): frames of whole lines with an index of the
+                    frames, so readers can start at any frame and parse
+                    workers split the file between them.""",
+        parents=[subparser14_args],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparser_modules.add_parser(
+        "serve", help="""Serve merge_bsmp and merge_sra over HTTP with the
+                      inputs kept in memory.""",
+        description="""Serve merge_bsmp (POST /merge_bsmp?BioProject=...,
+                    upload sheet as the body) and merge_sra (POST /merge_sra,
+                    form fields GISAID_upload and BioSample_attributes) over
+                    HTTP.  GISAID_json and the templates are parsed once and
+                    parsed again when they change on disk.""",
+        parents=[subparser11_args, subparser7_args, subparser4_args],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparser_modules.add_parser(
+        "bench", help="Time the table builders on synthetic data.",
+        description="""Time gisaid_json, merge_biosample_dfs and sra_builder on
+                    synthetic GISAID/NCBI inputs of each size and report wall
+                    time, CPU time and peak memory as JSON.""",
+        parents=[subparser9_args],
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     subparser_modules.add_parser(
         "version", help="""Get the version number.""",
@@ -88,11 +320,17 @@ def main():
     # print(args)
     # print(type(args.drop))
     # sys.exit()
+    if getattr(args, "since_ledger", False) and not args.ledger:
+        print("--since-ledger needs --ledger", file=sys.stderr)
+        sys.exit(1)
+    profile = getattr(args, "profile", None)
+    if profile or getattr(args, "profile_stage", None):
+        from .utils.profiler import PROFILER
+        PROFILER.enable(args.profile_stage, args.profile_hook)
 
     if not args.subparser_name:
         parser.print_help()
     elif args.subparser_name == "merge_bsmp":
-        from .utils.table_maker import Table, merge_biosample_dfs
         infiles = {'GISAID_upload': Path(args.GISAID_upload),
                    'NCBI_upload'  : Path(args.NCBI_upload),
                    'GISAID_json'  : Path(args.GISAID_json)}
@@ -105,32 +343,132 @@ def main():
                 pass
         if exit_cue:
             sys.exit()
-        GISAIDtemplate = Table(infiles['GISAID_upload']).gisaid_template(args.replacement)
-        NCBItemplate   = Table(infiles['NCBI_upload']).ncbi_template()
-        # import bz2
-        # import zipfile
-        # print(help(bz2))
-        # infile = zipfile.ZipFile(infiles['GISAID_json'])#.ZipInfo.compress_type
-        # print(infile)
-        # if zipfile.ZIP_BZIP2(infiles['GISAID_json']):
-            # print('ZIPPED')
-        GISAIDjson     = Table(infiles['GISAID_json']).gisaid_json(args.replacement,
-                                                                   args.drop,
-                                                                   args.bzgrep_regex)
+        max_memory = None
+        if args.max_memory:
+            from .utils.spill import parse_size
+            try:
+                max_memory = parse_size(args.max_memory)
+            except ValueError as error:
+                print(error, file=sys.stderr)
+                sys.exit(1)
+        from .api import bsmp_inputs
+        from .utils.table_maker import merge_biosample_dfs
+        from .utils.cache import open_cache
+        from .utils.profiler import PROFILER
+        from .utils.scheduler import InputError
+        from .utils.writer import TSVWriter
+        try:
+            NCBItemplate, GISAIDtemplate, GISAIDjson = bsmp_inputs(
+                infiles['NCBI_upload'], infiles['GISAID_upload'],
+                infiles['GISAID_json'], args.replacement, args.index,
+                max_memory, args.spill_dir,
+                todrop=args.drop,
+                bzgrep_regex=args.bzgrep_regex,
+                prefilter=args.prefilter,
+                match_fields=args.match_field,
+                threads=args.threads,
+                cache=open_cache(infiles['GISAID_json'], args.cache_dir,
+                                 args.cache or args.refresh_cache,
+                                 args.cache_entries),
+                refresh_cache=args.refresh_cache,
+                workers=args.parse_workers)
+        except InputError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
         # print(GISAIDjson)
+        if args.ledger:
+            from .utils.ledger import Ledger, bsmp_digests
+            ledger  = Ledger(args.ledger)
+            digests = bsmp_digests(GISAIDtemplate, GISAIDjson,
+                                   args.BioProject, args.replacement)
+            if args.since_ledger:
+                with PROFILER.stage("ledger_pending"):
+                    pending = ledger.pending("bsmp", digests)
+                print(f"{int(pending.sum())} of {len(pending)} rows new or "
+                      f"changed since {args.ledger}", file=sys.stderr)
+                GISAIDtemplate = GISAIDtemplate[pending.to_numpy()]
+                digests = digests[pending.to_numpy()]
         merged = merge_biosample_dfs(NCBItemplate,
                            GISAIDtemplate,
                            GISAIDjson,
                            args.BioProject,
                            args.replacement)
-        pos = 0
-        block_size = 1000
-        while pos < merged.shape[0]:
-            print(merged.iloc[pos:pos+block_size, :].to_csv(sep="\t", index=False)) #prints 1000 rows of data
-            pos+=block_size
+        with PROFILER.stage("write", merged.shape[0]), \
+             TSVWriter(args.output, args.buffer_size,
+                       args.gzip or None) as writer:
+            writer.write(merged)
+        if args.ledger:
+            with ledger:
+                ledger.record("bsmp", digests)
+
+    elif args.subparser_name == "merge_batch":
+        infiles = {'NCBI_upload'  : Path(args.NCBI_upload),
+                   'GISAID_json'  : Path(args.GISAID_json),
+                   'manifest'     : Path(args.manifest)}
+        exit_cue = False
+        for key in infiles:
+            if not infiles[key].is_file():
+                exit_cue = True
+                print(f"File not found: {infiles[key]}", file=sys.stderr)
+        if exit_cue:
+            sys.exit()
+        from .utils.table_maker import Table
+        from .utils.cache import open_cache
+        from .utils.batch import read_manifest, run_batch
+        from .utils.profiler import PROFILER
+        try:
+            entries = read_manifest(infiles['manifest'])
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        for entry in entries:
+            if not entry['GISAID_upload'].is_file():
+                exit_cue = True
+                print(f"File not found: {entry['GISAID_upload']}",
+                      file=sys.stderr)
+        if exit_cue:
+            sys.exit()
+        with PROFILER.stage("read_ncbi_template"):
+            NCBItemplate = Table(infiles['NCBI_upload']).ncbi_template()
+        GISAIDjson = None
+        if args.index:
+            from .utils.accession_index import AccessionIndex
+            with AccessionIndex(args.index) as index, \
+                 PROFILER.stage("index_update"):
+                index.update(infiles['GISAID_json'], args.threads)
+        else:
+            GISAIDjson = Table(infiles['GISAID_json']).gisaid_json(args.replacement,
+                                                                   args.drop,
+                                                                   args.bzgrep_regex,
+                                                                   args.prefilter,
+                                                                   args.match_field,
+                                                                   args.threads,
+                                                                   open_cache(infiles['GISAID_json'],
+                                                                              args.cache_dir,
+                                                                              args.cache or args.refresh_cache,
+                                                                              args.cache_entries),
+                                                                   args.refresh_cache,
+                                                                   ["covv_accession_id"],
+                                                                   args.parse_workers)
+            GISAIDjson = GISAIDjson[["covv_accession_id"]]
+        failed = False
+        with PROFILER.stage("merge_batch", len(entries)):
+            for entry, result in run_batch(entries, NCBItemplate,
+                                           args.replacement, GISAIDjson,
+                                           args.index, args.workers):
+                if isinstance(result, Exception):
+                    failed = True
+                    print(f"{entry['GISAID_upload']}: {result!r}",
+                          file=sys.stderr)
+                else:
+                    print(f"{entry['output']}: {result} rows",
+                          file=sys.stderr)
+        if failed:
+            if profile:
+                PROFILER.write(None if profile == "-" else profile)
+            sys.exit(1)
 
     elif args.subparser_name == "merge_sra":
-        from .utils.sra_builder import SRA_table 
         infiles = {'GISAID_upload'    : Path(args.GISAID_upload),
                    'NCBI_attributes'  : Path(args.BioSample_attributes),
                    'SRA_template'     : Path(args.SRA_template)}
@@ -144,29 +482,155 @@ def main():
                 pass
         if exit_cue:
             sys.exit()
-        gisaid_upload = SRA_table().read_gisaid_metadata(infiles['GISAID_upload'])
-        bsmpl_attributes = SRA_table().bsmpl_attributes(infiles['NCBI_attributes'])
-        sra_table = SRA_table().sra_template(infiles['SRA_template'])
+        from .api import sra_inputs
+        from .utils.sra_builder import SRA_table
+        from .utils.profiler import PROFILER
+        from .utils.scheduler import InputError
+        from .utils.writer import TSVWriter
+        try:
+            gisaid_upload, bsmpl_attributes, sra_table = sra_inputs(
+                infiles['NCBI_attributes'], infiles['GISAID_upload'],
+                infiles['SRA_template'])
+        except InputError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        if args.ledger:
+            from .utils.ledger import Ledger, sra_digests
+            ledger  = Ledger(args.ledger)
+            ledger.accept(bsmpl_attributes)
+            digests = sra_digests(gisaid_upload, bsmpl_attributes)
+            if args.since_ledger:
+                with PROFILER.stage("ledger_pending"):
+                    pending = ledger.pending("sra", digests)
+                print(f"{int(pending.sum())} of {len(pending)} rows new or "
+                      f"changed since {args.ledger}", file=sys.stderr)
+                done = digests.index[~pending.to_numpy()]
+                gisaid_upload = gisaid_upload[~gisaid_upload.index.isin(done)]
+                bsmpl_attributes = bsmpl_attributes[
+                    ~bsmpl_attributes.index.isin(done)]
+                digests = digests[pending.to_numpy()]
         sra_to_upload = SRA_table()
-        df = sra_to_upload.sra_builder(gisaid_upload,
-                                       bsmpl_attributes,
-                                       sra_table)
-        pos = 0
-        block_size = 1000
-        while pos < df.shape[0]:
-            print(df.iloc[pos:pos+block_size, :].to_csv(sep="\t", index_label='biosample_accession')) #prints 1000 rows of data
-            pos+=block_size
-
-        # for i in range(0, df.shape[0], 1000)
-
-        # print(df.to_csv(sep="\t", index_label='biosample_accession'))
+        try:
+            df = sra_to_upload.sra_builder(gisaid_upload,
+                                           bsmpl_attributes,
+                                           sra_table)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        for source, names in sra_to_upload.unmatched.items():
+            if names:
+                print(f"{len(names)} virus names only in {source}: "
+                      f"{', '.join(map(str, names[:10]))}"
+                      f"{', ...' if len(names) > 10 else ''}",
+                      file=sys.stderr)
+        if args.unmatched:
+            with open(args.unmatched, "w") as unmatched:
+                unmatched.write("source\tvirus_name\n")
+                for source, names in sra_to_upload.unmatched.items():
+                    unmatched.writelines(f"{source}\t{name}\n"
+                                         for name in names)
+        with PROFILER.stage("write", df.shape[0]), \
+             TSVWriter(args.output, args.buffer_size, args.gzip or None,
+                       index=True,
+                       index_label='biosample_accession') as writer:
+            writer.write(df)
+        if args.ledger:
+            with ledger:
+                ledger.record("sra", digests[digests.index.isin(
+                    bsmpl_attributes.index)])
 
     elif args.subparser_name == "view_gsd":
+        if not Path(args.GISAID_json).is_file():
+            print(f"File not found: {args.GISAID_json}", file=sys.stderr)
+            sys.exit()
         from .utils.table_maker import Table
+        from .utils.cache import open_cache
+        from .utils.profiler import PROFILER
+        from .utils.writer import TSVWriter
         json_f = Table(args.GISAID_json)
         # print(json_f)
-        df = json_f.gisaid_json("unknown", args.drop)
-        print(df.to_csv(sep="\t"))
+        df = json_f.gisaid_json("unknown", args.drop, threads=args.threads,
+                                cache=open_cache(args.GISAID_json,
+                                                 args.cache_dir,
+                                                 args.cache or args.refresh_cache,
+                                                 args.cache_entries),
+                                refresh_cache=args.refresh_cache,
+                                columns=args.keep,
+                                workers=args.parse_workers)
+        with PROFILER.stage("write", df.shape[0]), \
+             TSVWriter(args.output, args.buffer_size, args.gzip or None,
+                       index=True) as writer:
+            writer.write(df)
+    elif args.subparser_name == "index":
+        missing = [infile for infile in args.GISAID_json
+                   if not Path(infile).is_file()]
+        for infile in missing:
+            print(f"File not found: {infile}", file=sys.stderr)
+        if missing:
+            sys.exit()
+        from .utils.accession_index import AccessionIndex
+        from .utils.profiler import PROFILER
+        with AccessionIndex(args.index) as index:
+            for infile in args.GISAID_json:
+                with PROFILER.stage("index_update"):
+                    count = index.update(infile, args.threads)
+                PROFILER.count("index_update", count)
+                print(f"{infile}: {count} records indexed", file=sys.stderr)
+    elif args.subparser_name == "convert":
+        if not Path(args.GISAID_json).is_file():
+            print(f"File not found: {args.GISAID_json}", file=sys.stderr)
+            sys.exit()
+        from .utils.codec import convert
+        from .utils.spill import parse_size
+        try:
+            frames = convert(args.GISAID_json, args.output,
+                             parse_size(args.frame_size), args.level,
+                             args.threads)
+        except (ImportError, ValueError, OSError) as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        print(f"{args.output}: {frames} frames", file=sys.stderr)
+    elif args.subparser_name == "serve":
+        infiles = {'NCBI_upload'  : Path(args.NCBI_upload),
+                   'GISAID_json'  : Path(args.GISAID_json)}
+        if args.SRA_template:
+            infiles['SRA_template'] = Path(args.SRA_template)
+        exit_cue = False
+        for key in infiles:
+            if not infiles[key].is_file():
+                exit_cue = True
+                print(f"File not found: {infiles[key]}", file=sys.stderr)
+        if exit_cue:
+            sys.exit()
+        from .utils.cache import open_cache
+        from .utils.server import MergeService, serve
+        json_args = {}
+        if not args.index:
+            json_args = {"todrop"      : args.drop,
+                         "bzgrep_regex": args.bzgrep_regex,
+                         "prefilter"   : args.prefilter,
+                         "match_fields": args.match_field,
+                         "cache"       : open_cache(infiles['GISAID_json'],
+                                                    args.cache_dir,
+                                                    args.cache or args.refresh_cache,
+                                                    args.cache_entries),
+                         "refresh_cache": args.refresh_cache,
+                         "workers"     : args.parse_workers}
+        service = MergeService(infiles['NCBI_upload'], infiles['GISAID_json'],
+                               infiles.get('SRA_template'), args.replacement,
+                               args.index, args.threads, **json_args)
+        serve(service, args.host, args.port, args.socket, args.verbose)
+    elif args.subparser_name == "bench":
+        import json
+        from .utils.bench import run_bench
+        results = run_bench(args.workdir, args.sizes, args.stages, args.seed,
+                            args.tracemalloc)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
     elif args.subparser_name == "version":
         from . import __version__
         print(__version__)
@@ -175,6 +639,8 @@ def main():
         from .tests.test_suite import suite
         runner = unittest.TextTestRunner(verbosity=2)
         runner.run(suite())
+    if profile or getattr(args, "profile_stage", None):
+        PROFILER.write(None if profile in (None, "-") else profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""
+    This module is the Python API of gnb.  Each input may be a path (or
+    bytes, or a binary file object) as on the command line, or already in
+    memory as a pandas DataFrame, a pyarrow Table or an iterable of record
+    dicts, and the merged tables are returned as DataFrames.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import os
+
+
+def _is_file(data):
+    """True if data is read from a file (a path, bytes or a file object)
+    rather than already in memory."""
+    return isinstance(data, (str, os.PathLike, bytes, bytearray)) or \
+           hasattr(data, "read")
+
+
+def _is_path(data):
+    return isinstance(data, (str, os.PathLike))
+
+
+def as_frame(data):
+    """data (a DataFrame, a pyarrow Table or an iterable of dicts) as a
+    DataFrame."""
+    import pandas as pd
+    if isinstance(data, pd.DataFrame):
+        return data
+    if hasattr(data, "to_pandas"):
+        return data.to_pandas()
+    return pd.DataFrame.from_records(list(data))
+
+
+def _keyed(df, key, usecols=None):
+    """df indexed by the column key (unless it already is), cut to
+    usecols."""
+    if df.index.name != key:
+        if key not in df.columns:
+            raise ValueError(f"No {key} column in the input table")
+        df = df.set_index(key)
+    if usecols is not None:
+        missing = [col for col in usecols
+                   if col != key and col not in df.columns]
+        if missing:
+            raise ValueError("Columns expected but not found: " +
+                             ", ".join(missing))
+        df = df[[col for col in usecols if col != key]]
+    return df
+
+
+def read_gisaid_upload(data, replacement="missing", usecols=None):
+    """The GISAID upload sheet as merge_biosample_dfs takes it, indexed by
+    covv_virus_name.  In memory, the rows are keyed by the covv_* headers
+    (the second header row of the sheet is not expected)."""
+    from .utils.table_maker import Table
+    if _is_file(data):
+        return Table(data).gisaid_template(replacement, usecols)
+    df = _keyed(as_frame(data), "covv_virus_name", usecols).copy()
+    df.replace("unknown", replacement, inplace=True)
+    return df
+
+
+def read_ncbi_template(data):
+    """The NCBI BioSample template; only its columns are used, so in
+    memory it may also be a list of the column names."""
+    import pandas as pd
+    from .utils.table_maker import Table
+    if _is_file(data):
+        return Table(data).ncbi_template()
+    if isinstance(data, (list, tuple)) and all(isinstance(col, str)
+                                               for col in data):
+        return pd.DataFrame(columns=list(data))
+    return as_frame(data)
+
+
+def read_gisaid_json(data, replacement="missing", todrop=None,
+                     bzgrep_regex=None, prefilter=False, match_fields=None,
+                     columns=None, names=None, **json_args):
+    """The GISAID download as gisaid_json gives it, indexed by
+    covv_virus_name.
+
+    Records in memory are dropped, filtered (bzgrep_regex, match_fields)
+    and projected (columns) as the lines of a file are.  A DataFrame or
+    pyarrow Table is taken as parsed when none of those are given.
+    json_args (threads, cache, refresh_cache, workers) only apply to
+    files, and cache only to paths.
+    """
+    from .utils.table_maker import (Table, ColumnBuffer, RecordParser,
+                                    CATEGORICAL_COLUMNS, replace_unknown,
+                                    _name_filter)
+    if _is_file(data):
+        if not _is_path(data):
+            json_args.pop("cache", None)
+        return Table(data).gisaid_json(replacement, todrop, bzgrep_regex,
+                                       prefilter, match_fields,
+                                       columns=columns, names=names,
+                                       **json_args)
+    if isinstance(todrop, str):
+        todrop = [todrop]
+    names = _name_filter(names)
+    if not (todrop or bzgrep_regex or columns) and hasattr(data, "columns"):
+        df = _keyed(as_frame(data), "covv_virus_name").copy()
+        replace_unknown(df, replacement)
+    else:
+        if hasattr(data, "columns"):
+            df = as_frame(data)
+            if df.index.name == "covv_virus_name":
+                df = df.reset_index()
+            data = df.to_dict("records")
+        parse = RecordParser(todrop, bzgrep_regex, False, match_fields,
+                             columns)
+        records = ColumnBuffer(CATEGORICAL_COLUMNS)
+        for record in data:
+            record = parse.record(dict(record))
+            if record is not None:
+                records.append(record["covv_virus_name"], record)
+        df = records.to_frame()
+        replace_unknown(df, replacement)
+    if names is not None and names.filtering:
+        df = df[df.index.isin(names.result())]
+    return df
+
+
+def read_sra_upload(data, usecols=None):
+    """The GISAID upload sheet as sra_builder takes it, indexed by
+    'Virus name'.  In memory, the rows are keyed by the human readable
+    headers (the second header row of the sheet)."""
+    from .utils.sra_builder import SRA_table
+    if _is_file(data):
+        return SRA_table().read_gisaid_metadata(data, usecols)
+    return _keyed(as_frame(data), "Virus name", usecols)
+
+
+def read_biosample_attributes(data):
+    """The BioSample attributes.tsv, indexed by sample_name."""
+    import io
+    from .utils.sra_builder import SRA_table
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    if _is_file(data):
+        return SRA_table().bsmpl_attributes(data)
+    return _keyed(as_frame(data), "sample_name")
+
+
+def read_sra_template(data):
+    """The SRA template; as for read_ncbi_template, only its columns are
+    used."""
+    from .utils.sra_builder import SRA_table
+    if _is_file(data):
+        return SRA_table().sra_template(data)
+    return read_ncbi_template(data)
+
+
+def bsmp_inputs(ncbi_upload, gisaid_upload, gisaid_json,
+                replacement="missing", index=None, max_memory=None,
+                spill_dir=None, **json_args):
+    """Read the inputs of merge_bsmp at once and return them as
+    (ncbiup, gisaidup, gisaidjson) for merge_biosample_dfs.
+
+    The GISAID download is only read for the virus names of the upload
+    sheet.  With index (an accession index path), gisaid_json (a path) is
+    added to the index and the names looked up in it; with max_memory
+    (bytes), it is read out of core.  Raises InputError naming the first
+    input that could not be read.
+    """
+    from .utils.profiler import PROFILER
+    from .utils.table_maker import UPLOAD_COLUMNS
+    from .utils.scheduler import InputLoader
+
+    def gisaid_upload_table():
+        with PROFILER.stage("read_gisaid_upload"):
+            return read_gisaid_upload(gisaid_upload, replacement,
+                                      UPLOAD_COLUMNS)
+
+    def ncbi_template():
+        with PROFILER.stage("read_ncbi_template"):
+            return read_ncbi_template(ncbi_upload)
+
+    def lookup_index(names):
+        from .utils.accession_index import AccessionIndex
+        if not _is_path(gisaid_json):
+            raise ValueError("An accession index needs GISAID_json as a "
+                             "path")
+        with AccessionIndex(index) as accessions:
+            with PROFILER.stage("index_update"):
+                accessions.update(gisaid_json, json_args.get("threads", 1))
+            with PROFILER.stage("index_lookup"):
+                df = accessions.lookup(names.result())
+        df.replace("unknown", replacement, inplace=True)
+        return df
+
+    def out_of_core(names):
+        from .utils.table_maker import Table
+        from .utils.spill import gisaid_out_of_core
+        chunk_args = {key: value for key, value in json_args.items()
+                      if key not in ("cache", "refresh_cache", "workers")}
+        with PROFILER.stage("gisaid_out_of_core"):
+            return gisaid_out_of_core(Table(gisaid_json), names, replacement,
+                                      max_memory, spill_dir,
+                                      columns=["covv_accession_id"],
+                                      **chunk_args)
+
+    # the upload sheet, NCBI template and GISAID download are read at once;
+    # the GISAID download reader skips other virus names once the upload
+    # sheet is in
+    loader = InputLoader()
+    upload = loader.submit("GISAID_upload", gisaid_upload_table)
+    loader.submit("NCBI_upload", ncbi_template)
+    names  = loader.names(upload, lambda df: df.index)
+    if index is not None:
+        loader.submit("GISAID_json", lookup_index, names)
+    elif max_memory is not None:
+        loader.submit("GISAID_json", out_of_core, names)
+    else:
+        loader.submit("GISAID_json", read_gisaid_json, gisaid_json,
+                      replacement, columns=["covv_accession_id"], names=names,
+                      **json_args)
+    inputs = loader.result()
+    PROFILER.count("read_gisaid_upload", inputs["GISAID_upload"].shape[0])
+    return inputs["NCBI_upload"], inputs["GISAID_upload"], inputs["GISAID_json"]
+
+
+def merge_bsmp(ncbi_upload, gisaid_upload, gisaid_json, bioproject,
+               replacement="missing", **kwargs):
+    """The NCBI BioSample table for the upload sheet, as gnb merge_bsmp
+    writes it.  kwargs are passed to bsmp_inputs, e.g. bzgrep_regex."""
+    from .utils.table_maker import merge_biosample_dfs
+    ncbiup, gisaidup, gisaidjson = bsmp_inputs(ncbi_upload, gisaid_upload,
+                                               gisaid_json, replacement,
+                                               **kwargs)
+    return merge_biosample_dfs(ncbiup, gisaidup, gisaidjson, bioproject,
+                               replacement)
+
+
+def sra_inputs(biosample_attributes, gisaid_upload, sra_template):
+    """Read the inputs of merge_sra at once and return them as
+    (gisaid_up, biosample_attributes, sra_table) for sra_builder.  Raises
+    InputError naming the first input that could not be read."""
+    from .utils.profiler import PROFILER
+    from .utils.sra_builder import UPLOAD_COLUMNS
+    from .utils.scheduler import InputLoader
+
+    def staged(stage, read, *args):
+        with PROFILER.stage(stage):
+            return read(*args)
+    loader = InputLoader()
+    loader.submit("GISAID_upload", staged, "read_gisaid_upload",
+                  read_sra_upload, gisaid_upload, UPLOAD_COLUMNS)
+    loader.submit("BioSample_attributes", staged, "read_attributes",
+                  read_biosample_attributes, biosample_attributes)
+    loader.submit("SRA_template", staged, "read_sra_template",
+                  read_sra_template, sra_template)
+    inputs = loader.result()
+    PROFILER.count("read_gisaid_upload", inputs["GISAID_upload"].shape[0])
+    PROFILER.count("read_attributes",
+                   inputs["BioSample_attributes"].shape[0])
+    return (inputs["GISAID_upload"], inputs["BioSample_attributes"],
+            inputs["SRA_template"])
+
+
+def merge_sra(biosample_attributes, gisaid_upload, sra_template):
+    """Return (df, unmatched): the SRA table, indexed by
+    biosample_accession, as gnb merge_sra writes it, and the virus names
+    found on one side only, by side."""
+    from .utils.sra_builder import SRA_table
+    builder = SRA_table()
+    df = builder.sra_builder(*sra_inputs(biosample_attributes, gisaid_upload,
+                                         sra_template))
+    return df, builder.unmatched
@@ -10,22 +10,18 @@ Unit Tests.
 """
 
 import unittest
-from .. import (__parent_dir__,
+from .. import (resource_filename,
                 __test_NCBI_up__,   
                 __test_GISAID_up__,
                 __test_GISAID_dwn__)
-import pkg_resources
 from ..utils.table_maker import Table, merge_biosample_dfs
 
 
 class MergeTestCasePass(unittest.TestCase):
     def setUp(self):
-        self.NCBIup    = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_NCBI_up__)
-        self.GISAIDup  = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_GISAID_up__)
-        self.GISAIDdwn = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_GISAID_dwn__)
+        self.NCBIup    = resource_filename(__test_NCBI_up__)
+        self.GISAIDup  = resource_filename(__test_GISAID_up__)
+        self.GISAIDdwn = resource_filename(__test_GISAID_dwn__)
 
     def versioner(self):
         from .. import __version__
@@ -41,11 +37,144 @@ class MergeTestCasePass(unittest.TestCase):
         df = NCBItemplate.ncbi_template()
         self.assertEqual(df.columns[0], "*sample_name")
 
+    def input_loader(self):
+        from ..utils import loader
+        self.assertEqual(loader.sniff(self.NCBIup), "xlsx")
+        self.assertEqual(loader.sniff(self.GISAIDup), "xls")
+        self.assertEqual(loader.sniff(self.GISAIDdwn), "csv")
+        self.assertTrue(loader.read_template(self.NCBIup, skiprows=12)
+                        .equals(Table(self.NCBIup).ncbi_template()))
+        # without an xlsx engine, xlsx is not read at all
+        from unittest import mock
+        with mock.patch.object(loader, "find_spec", return_value=None):
+            with self.assertRaises(ImportError):
+                loader.read_table(self.NCBIup, skiprows=12)
+
     def read_GISAID_json(self):
         GISAIDjson = Table(self.GISAIDdwn)
         df = GISAIDjson.gisaid_json("missing", "sequence")
         self.assertEqual(df.iloc[0,0], "achcov19/Xla/XC81/2121")
 
+    def read_GISAID_json_chunks(self):
+        import pandas as pd
+        GISAIDjson = Table(self.GISAIDdwn)
+        df = GISAIDjson.gisaid_json("missing")
+        chunks = list(GISAIDjson.gisaid_json_chunks("missing", chunksize=3))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(pd.concat(chunks).equals(df))
+
+    def prefilter_GISAID_json(self):
+        GISAIDjson = Table(self.GISAIDdwn)
+        for fields in [None, ["covv_location"]]:
+            df = GISAIDjson.gisaid_json("missing", None, "XC8|Xla", False,
+                                        fields)
+            df_raw = GISAIDjson.gisaid_json("missing", None, "XC8|Xla", True,
+                                            fields)
+            self.assertTrue(df_raw.equals(df))
+        # matches across two values, or against None where the line has
+        # null, are only seen after parsing
+        df = GISAIDjson.gisaid_json("missing", None, "Femile Original", True)
+        self.assertEqual(df.shape[0], 8)
+        from ..utils.table_maker import RecordParser, RawLineFilter
+        self.assertFalse(RawLineFilter.exact("None"))
+        line = b'{"covv_virus_name": "a/b/c", "covv_passage": null}'
+        self.assertIsNotNone(RecordParser(None, "None", True)(line))
+        line = b'{"covv_virus_name": "a/b/c", "covv_location": [1, 2]}'
+        self.assertTrue(RawLineFilter("2", ["covv_location"])(line))
+
+    def parallel_bz2_lines(self):
+        import bz2
+        from ..utils.decompress import bz2_lines
+        with bz2.BZ2File(self.GISAIDdwn, "r") as file:
+            lines = list(file)
+        self.assertEqual(list(bz2_lines(self.GISAIDdwn, threads=2)), lines)
+
+    def cached_GISAID_json(self):
+        import contextlib
+        import io
+        import tempfile
+        from pathlib import Path
+        from ..utils.cache import GisaidCache
+        if not GisaidCache.available():
+            self.skipTest("pyarrow not installed")
+        GISAIDjson = Table(self.GISAIDdwn)
+        df = GISAIDjson.gisaid_json("missing")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = GisaidCache(tmpdir, max_entries=1)
+            GISAIDjson.gisaid_json("missing", cache=cache)
+            self.assertTrue(GISAIDjson.gisaid_json("missing",
+                                                   cache=cache).equals(df))
+            GISAIDjson.gisaid_json("unknown", cache=cache)
+            self.assertEqual(len(list(cache.cache_dir.glob("*.feather"))), 1)
+            # a truncated entry is rebuilt
+            entry, = cache.cache_dir.glob("*.feather")
+            entry.write_bytes(entry.read_bytes()[:100])
+            rebuilt = GISAIDjson.gisaid_json("unknown", cache=cache)
+            self.assertTrue(rebuilt.equals(GISAIDjson.gisaid_json("unknown")))
+            self.assertGreater(entry.stat().st_size, 100)
+            # a cache that cannot be written is skipped
+            blocker = Path(tmpdir) / "file"
+            blocker.touch()
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertTrue(GISAIDjson.gisaid_json(
+                    "missing", cache=GisaidCache(blocker / "cache")).equals(df))
+        from ..utils.cache import open_cache
+        self.assertIsNone(open_cache(self.GISAIDdwn))
+
+    def stream_TSV_writer(self):
+        import gzip
+        import tempfile
+        from pathlib import Path
+        from ..utils.writer import TSVWriter
+        df = Table(self.GISAIDdwn).gisaid_json("missing")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outfile = Path(tmpdir) / "out.tsv.gz"
+            with TSVWriter(outfile, block_size=2, index=True) as writer:
+                for chunk in (df.iloc[:5], df.iloc[5:]):
+                    writer.write(chunk)
+            with gzip.open(outfile, "rt") as tsv:
+                self.assertEqual(tsv.read(), df.to_csv(sep="\t"))
+
+    def accession_index(self):
+        import bz2
+        import json
+        import tempfile
+        from pathlib import Path
+        from ..utils.accession_index import AccessionIndex
+        ncbiup     = Table(self.NCBIup).ncbi_template()
+        gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
+        gisaidjson = Table(self.GISAIDdwn).gisaid_json("missing")
+        merged     = merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                         "PRJNA613958", "missing")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with AccessionIndex(Path(tmpdir) / "index.sqlite") as index:
+                self.assertEqual(index.update(self.GISAIDdwn), 8)
+                self.assertEqual(index.update(self.GISAIDdwn), 0)
+                accessions = index.lookup(gisaidup.index)
+                record = index.record(gisaidjson.index[3])
+                # the last download indexed wins; one rewritten in place
+                # drops its old records, leaving those of other downloads
+                rewritten = Path(tmpdir) / "metadata.json"
+                with bz2.open(self.GISAIDdwn) as download:
+                    lines = download.readlines()
+                newer = json.loads(lines[1])
+                newer["covv_accession_id"] = "EPI_ISL_1"
+                lines[1] = json.dumps(newer).encode() + b"\n"
+                rewritten.write_bytes(b"".join(lines))
+                index.update(rewritten)
+                self.assertEqual(index.lookup(gisaidjson.index[:2]).loc[
+                    gisaidjson.index[1], "covv_accession_id"], "EPI_ISL_1")
+                rewritten.write_bytes(b"".join(lines[1:]))
+                self.assertEqual(index.update(rewritten), 7)
+                self.assertEqual(index.record(gisaidjson.index[0]),
+                                 json.loads(lines[0]))
+                self.assertEqual(index.record(gisaidjson.index[1]), newer)
+        self.assertTrue(merge_biosample_dfs(ncbiup, gisaidup, accessions,
+                                            "PRJNA613958",
+                                            "missing").equals(merged))
+        self.assertEqual(record["covv_accession_id"],
+                         gisaidjson.iloc[3].loc["covv_accession_id"])
+
     def merger_BioSample_upload(self):
         ncbiup     = Table(self.NCBIup).ncbi_template()
         gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
@@ -56,3 +185,374 @@ class MergeTestCasePass(unittest.TestCase):
                                "PRJNA613958",
                                "missing")
         self.assertEqual(merged.iloc[1].loc["host_age"], "65")
+        gisaidup["covv_location"] = float("nan")
+        merged     = merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                         "PRJNA613958", "missing")
+        self.assertTrue((merged["*geo_loc_name"] == "missing").all())
+
+    def merger_batch(self):
+        import tempfile
+        from pathlib import Path
+        from ..utils.batch import read_manifest, run_batch
+        ncbiup     = Table(self.NCBIup).ncbi_template()
+        gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
+        gisaidjson = Table(self.GISAIDdwn).gisaid_json("missing")
+        merged     = merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                         "PRJNA613958", "missing")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir) / "manifest.tsv"
+            manifest.write_text("GISAID_upload\tBioProject\toutput\n" +
+                                "".join(f"{self.GISAIDup}\tPRJNA613958\t"
+                                        f"out{i}.tsv\n" for i in range(2)))
+            entries = read_manifest(manifest)
+            results = list(run_batch(entries, ncbiup, "missing",
+                                     gisaidjson[["covv_accession_id"]],
+                                     workers=2))
+            self.assertEqual([rows for entry, rows in results], [3, 3])
+            for entry in entries:
+                self.assertEqual(entry["output"].read_text(),
+                                 merged.to_csv(sep="\t", index=False))
+
+    def bench_synthetic(self):
+        import io
+        import tempfile
+        from ..utils.bench import run_bench
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report = run_bench(tmpdir, [3000], log=io.StringIO())
+        self.assertEqual([result["stage"] for result in report["results"]],
+                         ["gisaid_json", "merge_biosample_dfs",
+                          "sra_builder"])
+        for result in report["results"]:
+            self.assertNotIn("error", result)
+            self.assertEqual(result["rows"], report["results"][0]["rows"])
+        # a stage whose process dies is reported, not fatal
+        import os
+        from unittest import mock
+        from ..utils.bench import STAGES
+        with mock.patch.dict(STAGES, {"dies": lambda paths: os._exit(3)}), \
+             tempfile.TemporaryDirectory() as tmpdir:
+            report = run_bench(tmpdir, [10], ["dies", "gisaid_json"],
+                               log=io.StringIO())
+        self.assertEqual(report["results"][0]["error"], "exit 3")
+        self.assertNotIn("error", report["results"][1])
+
+    def profiler_stages(self):
+        from ..utils.profiler import PROFILER
+        self.assertIs(PROFILER.wrap("parse", len), len)
+        PROFILER.enable()
+        try:
+            df = Table(self.GISAIDdwn).gisaid_json("missing", None, ".",
+                                                   prefilter=True)
+            stages = {stats["stage"]: stats
+                      for stats in PROFILER.report()["stages"]}
+        finally:
+            PROFILER.disable()
+        self.assertEqual(stages["gisaid_json"]["records"], df.shape[0])
+        self.assertEqual(stages["gisaid_json.decompress"]["records"], 8)
+        self.assertEqual(stages["gisaid_json.parse"]["calls"], 8)
+        self.assertEqual(PROFILER.stages, {})
+        # stages recorded from several threads at once add up
+        from concurrent.futures import ThreadPoolExecutor
+        PROFILER.enable()
+        try:
+            timed = PROFILER.wrap("parse", len)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for _ in executor.map(lambda _: [timed("x")
+                                                 for call in range(5000)],
+                                      range(4)):
+                    pass
+            self.assertEqual(PROFILER.stages["parse"]["calls"], 20000)
+        finally:
+            PROFILER.disable()
+
+    def projected_GISAID_json(self):
+        from ..utils.table_maker import FieldExtractor
+        columns = ["covv_accession_id", "covv_location"]
+        full = Table(self.GISAIDdwn).gisaid_json("missing")
+        kept = Table(self.GISAIDdwn).gisaid_json("missing", columns=columns)
+        self.assertTrue(kept.equals(full[["covv_virus_name"] + columns]))
+        dropped = Table(self.GISAIDdwn).gisaid_json("missing",
+                                                    "covv_location")
+        self.assertTrue(dropped.equals(full.drop(columns="covv_location")))
+        extract = FieldExtractor(["covv_virus_name", "sequence_length"])
+        self.assertEqual(extract(b'{"covv_virus_name": "hCoV-19/A/1/2020", '
+                                 b'"sequence": "ACGT", '
+                                 b'"sequence_length": 29903}'),
+                         {"covv_virus_name": "hCoV-19/A/1/2020",
+                          "sequence_length": 29903})
+        self.assertIsNone(extract(b'{"covv_virus_name": "A \\"B\\""}'))
+
+    def categorical_GISAID_json(self):
+        import pandas as pd
+        from ..utils.table_maker import replace_unknown
+        df = Table(self.GISAIDdwn).gisaid_json("missing")
+        self.assertIsInstance(df["covv_location"].dtype, pd.CategoricalDtype)
+        gender = pd.DataFrame({"covv_gender": pd.Categorical(
+            ["unknown", "missing", None, "Male"])})
+        replace_unknown(gender, "missing")
+        self.assertEqual(list(gender["covv_gender"].cat.categories),
+                         ["Male", "missing"])
+        self.assertEqual(gender["covv_gender"].tolist()[:2],
+                         ["missing", "missing"])
+        self.assertTrue(gender["covv_gender"].isnull().iloc[2])
+        from ..utils.table_maker import ColumnBuffer
+        mixed = ColumnBuffer(["covv_host", "covv_gender"])
+        for key, value in enumerate([True, 1, 1.0, "1"]):
+            mixed.append(key, {"covv_host": value, "covv_gender": "Male"})
+        mixed.append(4, {"covv_host": ["Human"], "covv_gender": None})
+        df = mixed.to_frame()
+        self.assertEqual([type(value) for value in df["covv_host"]],
+                         [bool, int, float, str, list])
+        self.assertIsInstance(df["covv_gender"].dtype, pd.CategoricalDtype)
+        self.assertTrue(df["covv_gender"].isnull().iloc[4])
+
+    def merge_service(self):
+        import contextlib
+        import io
+        import threading
+        import urllib.error
+        import urllib.request
+        from ..utils.server import MergeService, make_server
+        ncbiup     = Table(self.NCBIup).ncbi_template()
+        gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
+        gisaidjson = Table(self.GISAIDdwn).gisaid_json("missing")
+        merged     = merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                         "PRJNA613958", "missing")
+        server = make_server(MergeService(self.NCBIup, self.GISAIDdwn),
+                             port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = "http://{}:{}/merge_bsmp?BioProject=PRJNA613958" \
+                  .format(*server.server_address)
+            with open(self.GISAIDup, "rb") as upload:
+                request = urllib.request.Request(url, data=upload.read())
+            for attempt in range(2):
+                with urllib.request.urlopen(request) as response:
+                    self.assertEqual(response.read().decode(),
+                                     merged.to_csv(sep="\t", index=False))
+            self.assertEqual(server.service.gisaidjson.loads, 1)
+            bad = urllib.request.Request(url, data=b"not a spreadsheet")
+            with self.assertRaises(urllib.error.HTTPError) as caught:
+                urllib.request.urlopen(bad)
+            self.assertEqual(caught.exception.code, 400)
+            self.assertIn("GISAID_upload", caught.exception.read().decode())
+
+            def fail(path):
+                raise RuntimeError("template unreadable")
+            server.service.ncbiup.load  = fail
+            server.service.ncbiup.stamp = None
+            with self.assertRaises(urllib.error.HTTPError) as caught, \
+                 contextlib.redirect_stderr(io.StringIO()) as stderr:
+                urllib.request.urlopen(request)
+            self.assertEqual(caught.exception.code, 500)
+            self.assertNotIn("template unreadable",
+                             caught.exception.read().decode())
+            self.assertIn("RuntimeError: template unreadable",
+                          stderr.getvalue())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def startup_budget(self):
+        """gnb version, and the report of missing inputs, without
+        importing pandas or numpy"""
+        import os
+        import subprocess
+        import sys
+        from pathlib import Path
+        env = dict(os.environ)
+        paths = [str(Path(__file__).resolve().parents[2])]
+        if env.get("PYTHONPATH"):
+            paths.append(env["PYTHONPATH"])
+        env["PYTHONPATH"] = os.pathsep.join(paths)
+
+        def imported(*args):
+            run = subprocess.run([sys.executable, "-X", "importtime", "-m",
+                                  "gnb", *args], env=env,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+            return run, [line.split("|")[-1].strip()
+                         for line in run.stderr.splitlines()
+                         if line.startswith("import time:")]
+        run, modules = imported("version")
+        self.assertEqual(run.returncode, 0)
+        self.assertNotIn("pandas", modules)
+        self.assertNotIn("numpy", modules)
+        run, modules = imported("merge_bsmp", "missing.xlsx", "missing.xls",
+                                "missing.json.bz2", "PRJNA613958")
+        self.assertIn("File not found: missing.xlsx", run.stderr)
+        self.assertNotIn("pandas", modules)
+
+    def out_of_core_merge(self):
+        from ..utils.spill import gisaid_out_of_core, parse_size
+        self.assertEqual(parse_size("1.5K"), 1536)
+        ncbiup     = Table(self.NCBIup).ncbi_template()
+        gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
+        gisaidjson = Table(self.GISAIDdwn).gisaid_json("missing")
+        merged     = merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                         "PRJNA613958", "missing")
+        spilled = gisaid_out_of_core(Table(self.GISAIDdwn), gisaidup.index,
+                                     "missing", parse_size("8K"),
+                                     partitions=4)
+        self.assertEqual(sorted(spilled.index),
+                         sorted(set(gisaidup.index) & set(gisaidjson.index)))
+        self.assertTrue(merge_biosample_dfs(ncbiup, gisaidup, spilled,
+                                            "PRJNA613958",
+                                            "missing").equals(merged))
+        # runs sharing a spill directory each get their own partitions
+        import tempfile
+        from pathlib import Path
+        from ..utils.spill import PartitionedSpill
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with PartitionedSpill(tmpdir, 2) as first, \
+                 PartitionedSpill(tmpdir, 2) as second:
+                first.write(gisaidjson)
+                self.assertNotEqual(first.directory, second.directory)
+                self.assertEqual(sum(first.rows), gisaidjson.shape[0])
+                self.assertEqual(list(second.read(0)), [])
+            self.assertEqual(list(Path(tmpdir).iterdir()), [])
+
+    def parallel_parse_GISAID_json(self):
+        from ..utils import table_maker
+        df = Table(self.GISAIDdwn).gisaid_json("missing", None, "XC8")
+        batch = table_maker.PARSE_BATCH
+        table_maker.PARSE_BATCH = 500
+        try:
+            parallel = Table(self.GISAIDdwn).gisaid_json("missing", None,
+                                                         "XC8", workers=2)
+        finally:
+            table_maker.PARSE_BATCH = batch
+        self.assertTrue(parallel.equals(df))
+
+    def submission_ledger(self):
+        import tempfile
+        from pathlib import Path
+        from .. import __test_NCBI_SMPL__
+        from ..utils.ledger import Ledger, bsmp_digests
+        from ..utils.sra_builder import SRA_table
+        gisaidup   = Table(self.GISAIDup).gisaid_template("missing")
+        gisaidjson = Table(self.GISAIDdwn).gisaid_json("missing")
+        digests    = bsmp_digests(gisaidup, gisaidjson, "PRJNA613958",
+                                  "missing")
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             Ledger(Path(tmpdir) / "ledger.db") as ledger:
+            self.assertTrue(ledger.pending("bsmp", digests).all())
+            ledger.record("bsmp", digests)
+            self.assertFalse(ledger.pending("bsmp", digests).any())
+            changed = gisaidup.copy()
+            changed.iloc[0, changed.columns.get_loc("covv_patient_age")] = "99"
+            pending = ledger.pending("bsmp", bsmp_digests(changed, gisaidjson,
+                                                          "PRJNA613958",
+                                                          "missing"))
+            self.assertEqual(list(pending[pending].index), [gisaidup.index[0]])
+            self.assertTrue(ledger.pending("bsmp", bsmp_digests(
+                gisaidup, gisaidjson, "PRJNA000000", "missing")).all())
+            # accepted by NCBI without being emitted by gnb
+            attributes = SRA_table().bsmpl_attributes(
+                resource_filename(__test_NCBI_SMPL__))
+            self.assertEqual(ledger.accept(attributes), attributes.shape[0])
+            self.assertFalse(ledger.pending("bsmp", digests).any())
+            self.assertTrue(ledger.pending("sra", digests).all())
+
+    def concurrent_inputs(self):
+        from ..utils.scheduler import InputLoader, InputError
+        df = Table(self.GISAIDdwn).gisaid_json("missing")
+        loader = InputLoader()
+        upload = loader.submit("GISAID_upload",
+                               Table(self.GISAIDup).gisaid_template, "missing")
+        loader.submit("GISAID_json", Table(self.GISAIDdwn).gisaid_json,
+                      "missing", names=loader.names(upload,
+                                                    lambda df: df.index))
+        inputs = loader.result()
+        self.assertTrue(inputs["GISAID_json"].equals(
+            df[df.index.isin(inputs["GISAID_upload"].index)]))
+        loader = InputLoader()
+        upload = loader.submit("GISAID_upload",
+                               Table(self.GISAIDdwn).gisaid_template,
+                               "missing")
+        loader.submit("GISAID_json", Table(self.GISAIDdwn).gisaid_json,
+                      "missing", names=loader.names(upload,
+                                                    lambda df: df.index))
+        with self.assertRaisesRegex(InputError, "GISAID_upload"):
+            loader.result()
+
+    def in_memory_api(self):
+        import bz2
+        import io
+        import json
+        from .. import api
+        merged = api.merge_bsmp(self.NCBIup, self.GISAIDup, self.GISAIDdwn,
+                                "PRJNA613958", bzgrep_regex="XC8")
+        with bz2.open(self.GISAIDdwn) as handle:
+            records = [json.loads(line) for line in handle]
+        # the files may also be given as bytes or binary file objects
+        def read(path):
+            with open(path, "rb") as handle:
+                return handle.read()
+        self.assertTrue(api.merge_bsmp(read(self.NCBIup),
+                                       io.BytesIO(read(self.GISAIDup)),
+                                       io.BytesIO(read(self.GISAIDdwn)),
+                                       "PRJNA613958",
+                                       bzgrep_regex="XC8").equals(merged))
+        self.assertTrue(api.merge_bsmp(io.BytesIO(read(self.NCBIup)),
+                                       read(self.GISAIDup),
+                                       read(self.GISAIDdwn), "PRJNA613958",
+                                       bzgrep_regex="XC8").equals(merged))
+        gisaidup = Table(self.GISAIDup).gisaid_template("unknown")
+        ncbiup   = list(Table(self.NCBIup).ncbi_template().columns)
+        for gisaidjson in (records, api.as_frame(records)):
+            self.assertTrue(api.merge_bsmp(ncbiup, gisaidup.reset_index(),
+                                           gisaidjson, "PRJNA613958",
+                                           bzgrep_regex="XC8").equals(merged))
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return
+        self.assertTrue(api.merge_bsmp(ncbiup, gisaidup,
+                                       pa.Table.from_pylist(records),
+                                       "PRJNA613958",
+                                       bzgrep_regex="XC8").equals(merged))
+
+    def input_codecs(self):
+        import bz2
+        import gzip
+        import io
+        import lzma
+        import tarfile
+        import tempfile
+        from pathlib import Path
+        from ..utils import codec
+        with bz2.BZ2File(self.GISAIDdwn, "r") as file:
+            lines = list(file)
+        raw = b"".join(lines)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            (tmpdir / "plain.json").write_bytes(raw)
+            (tmpdir / "gzip.json.gz").write_bytes(gzip.compress(raw))
+            (tmpdir / "xz.json.xz").write_bytes(lzma.compress(raw))
+            with tarfile.open(tmpdir / "tar.tar.xz", "w:xz") as archive:
+                member = tarfile.TarInfo("metadata.json")
+                member.size = len(raw)
+                archive.addfile(member, io.BytesIO(raw))
+            for path, name in [(self.GISAIDdwn, "bz2"),
+                               (tmpdir / "plain.json", "plain"),
+                               (tmpdir / "gzip.json.gz", "gzip"),
+                               (tmpdir / "xz.json.xz", "xz"),
+                               (tmpdir / "tar.tar.xz", "xz")]:
+                self.assertEqual(codec.detect(path), name)
+                self.assertEqual(list(codec.input_lines(path)), lines)
+            try:
+                import zstandard
+            except ImportError:
+                return
+            seekable = tmpdir / "seekable.json.zst"
+            self.assertEqual(codec.convert(self.GISAIDdwn, seekable,
+                                           frame_size=300), 8)
+            self.assertEqual(list(codec.input_lines(seekable, 2)), lines)
+            self.assertEqual(codec.line_at(seekable, len(lines[0])),
+                             lines[1])
+            df = Table(self.GISAIDdwn).gisaid_json("missing", None, "XC8")
+            self.assertTrue(Table(str(seekable)).gisaid_json(
+                "missing", None, "XC8", workers=2).equals(df))
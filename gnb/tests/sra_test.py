@@ -10,22 +10,18 @@ Unit Tests.
 """
 
 import unittest
-from .. import (__parent_dir__,
+from .. import (resource_filename,
                 __test_GISAID_up__,
                 __test_NCBI_SMPL__,
                 __test_SRA_up__     )
-import pkg_resources
 from ..utils.sra_builder import SRA_table
 
 
 class SRATestCasePass(unittest.TestCase):
     def setUp(self):
-        self.GISAIDup  = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_GISAID_up__)
-        self.NCBIbsmpl = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_NCBI_SMPL__)
-        self.SRAup     = pkg_resources.resource_filename(__parent_dir__,
-                                                         __test_SRA_up__)
+        self.GISAIDup  = resource_filename(__test_GISAID_up__)
+        self.NCBIbsmpl = resource_filename(__test_NCBI_SMPL__)
+        self.SRAup     = resource_filename(__test_SRA_up__)
 
     def SRA_template(self):
         """Check the readability and format of SRA template .xlsx
@@ -65,4 +61,59 @@ class SRATestCasePass(unittest.TestCase):
                                 sra_table)
         self.assertEqual(df.iloc[1,0], "XC80_illumina")
 
+    def unmapped_technology(self):
+        """Check unknown sequencing technologies are reported together
+        """
+        gisaid_upload = SRA_table().read_gisaid_metadata(self.GISAIDup)
+        gisaid_upload['Sequencing technology'] = ["Oxford Nanopore",
+                                                  "Illumina iSeq",
+                                                  "PacBio"]
+        bsmpl_attributes = SRA_table().bsmpl_attributes(self.NCBIbsmpl)
+        sra_table = SRA_table().sra_template(self.SRAup)
+        with self.assertRaisesRegex(ValueError, "Oxford Nanopore, PacBio"):
+            SRA_table().sra_builder(gisaid_upload,
+                                    bsmpl_attributes,
+                                    sra_table)
 
+    def unmatched_keys(self):
+        """Check only matched virus names are joined and the rest reported
+        """
+        gisaid_upload = SRA_table().read_gisaid_metadata(self.GISAIDup)
+        bsmpl_attributes = SRA_table().bsmpl_attributes(self.NCBIbsmpl)
+        sra_table = SRA_table().sra_template(self.SRAup)
+        sra_to_upload = SRA_table()
+        df = sra_to_upload.sra_builder(gisaid_upload,
+                                       bsmpl_attributes.iloc[::-1].iloc[1:],
+                                       sra_table)
+        self.assertEqual(list(df.index), ["SAMNdummy2", "SAMNdummy3"])
+        self.assertEqual(sra_to_upload.unmatched,
+                         {"GISAID_upload": [gisaid_upload.index[2]],
+                          "BioSample_attributes": []})
+        with self.assertRaisesRegex(ValueError, "Repeated virus name"):
+            SRA_table().sra_builder(gisaid_upload,
+                                    bsmpl_attributes.iloc[[0, 0, 1]],
+                                    sra_table)
+
+    def in_memory_api(self):
+        """Check merge_sra takes DataFrames as well as files
+        """
+        import io
+        from .. import api
+        df, _ = api.merge_sra(self.NCBIbsmpl, self.GISAIDup, self.SRAup)
+        gisaid_upload = SRA_table().read_gisaid_metadata(self.GISAIDup)
+        bsmpl_attributes = SRA_table().bsmpl_attributes(self.NCBIbsmpl)
+        sra_table = SRA_table().sra_template(self.SRAup)
+        in_memory, unmatched = api.merge_sra(bsmpl_attributes.reset_index(),
+                                             gisaid_upload.reset_index(),
+                                             list(sra_table.columns))
+        self.assertTrue(in_memory.equals(df))
+        self.assertEqual(unmatched,
+                         {"GISAID_upload": [], "BioSample_attributes": []})
+        # the files may also be given as bytes or binary file objects
+        inputs = []
+        for path in (self.NCBIbsmpl, self.GISAIDup, self.SRAup):
+            with open(path, "rb") as handle:
+                inputs.append(handle.read())
+        self.assertTrue(api.merge_sra(*inputs)[0].equals(df))
+        self.assertTrue(api.merge_sra(*map(io.BytesIO, inputs))[0]
+                        .equals(df))
@@ -20,12 +20,35 @@ def suite():
     """
     suite = unittest.TestSuite()
     suite.addTest(MergeTestCasePass("versioner"))
+    suite.addTest(MergeTestCasePass("startup_budget"))
     suite.addTest(MergeTestCasePass("read_gisaid_template"))
     suite.addTest(MergeTestCasePass("read_ncbi_template"))
+    suite.addTest(MergeTestCasePass("input_loader"))
     suite.addTest(MergeTestCasePass("read_GISAID_json"))
+    suite.addTest(MergeTestCasePass("read_GISAID_json_chunks"))
+    suite.addTest(MergeTestCasePass("prefilter_GISAID_json"))
+    suite.addTest(MergeTestCasePass("projected_GISAID_json"))
+    suite.addTest(MergeTestCasePass("categorical_GISAID_json"))
+    suite.addTest(MergeTestCasePass("parallel_bz2_lines"))
+    suite.addTest(MergeTestCasePass("input_codecs"))
+    suite.addTest(MergeTestCasePass("parallel_parse_GISAID_json"))
+    suite.addTest(MergeTestCasePass("concurrent_inputs"))
+    suite.addTest(MergeTestCasePass("in_memory_api"))
+    suite.addTest(MergeTestCasePass("cached_GISAID_json"))
+    suite.addTest(MergeTestCasePass("stream_TSV_writer"))
+    suite.addTest(MergeTestCasePass("accession_index"))
     suite.addTest(MergeTestCasePass("merger_BioSample_upload"))
+    suite.addTest(MergeTestCasePass("merger_batch"))
+    suite.addTest(MergeTestCasePass("out_of_core_merge"))
+    suite.addTest(MergeTestCasePass("submission_ledger"))
+    suite.addTest(MergeTestCasePass("merge_service"))
+    suite.addTest(MergeTestCasePass("bench_synthetic"))
+    suite.addTest(MergeTestCasePass("profiler_stages"))
     suite.addTest(SRATestCasePass("SRA_template"))
     suite.addTest(SRATestCasePass("biosample_attributes"))
     suite.addTest(SRATestCasePass("gisaid_template"))
     suite.addTest(SRATestCasePass("sra_build"))
+    suite.addTest(SRATestCasePass("unmapped_technology"))
+    suite.addTest(SRATestCasePass("unmatched_keys"))
+    suite.addTest(SRATestCasePass("in_memory_api"))
     return suite
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+    This module keeps a persistent index of GISAID virus names, so that
+    BioSample merges can look up accessions without scanning a download.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER,
+    mtime_ns INTEGER,
+    records  INTEGER,
+    indexed  INTEGER
+);
+CREATE TABLE IF NOT EXISTS records (
+    covv_virus_name   TEXT,
+    covv_accession_id TEXT,
+    source            TEXT,
+    offset            INTEGER,
+    PRIMARY KEY (covv_virus_name, source)
+);
+CREATE INDEX IF NOT EXISTS records_source ON records (source);
+"""
+# PRAGMA user_version of an index with SCHEMA; older ones are rebuilt
+SCHEMA_VERSION = 1
+FIELDS = {field: re.compile(rb'"' + re.escape(field.encode()) +
+                            rb'"\s*:\s*("[^"\\]*"|null)')
+          for field in ("covv_virus_name", "covv_accession_id")}
+BATCH  = 10000
+LOOKUP = 500
+
+
+def name_and_accession(line):
+    """Return (covv_virus_name, covv_accession_id) from a raw json line,
+    without parsing the rest of the record."""
+    values = []
+    if b"\\" not in line:
+        for regex in FIELDS.values():
+            found = regex.search(line)
+            if found is None:
+                break
+            values.append(json.loads(found.group(1)))
+    if len(values) < len(FIELDS):
+        record = json.loads(line)
+        values = [record.get(field) for field in FIELDS]
+    return tuple(values)
+
+
+class AccessionIndex():
+    """SQLite index of covv_virus_name to covv_accession_id and the
+    offset of each record's line in the decompressed download.
+
+    Each download is scanned once and its records kept under it, so a
+    virus name may be in several downloads; the last download indexed
+    wins.  A download re-indexed after it changed replaces all of its
+    earlier records, and names only in other downloads are kept.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.db   = sqlite3.connect(os.fspath(self.path))
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # one virus name per index before; the downloads are re-read
+            self.db.executescript("DROP TABLE IF EXISTS records; "
+                                  "DROP TABLE IF EXISTS sources;")
+        self.db.executescript(SCHEMA)
+        self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def is_current(self, indata):
+        """True if indata, as it is now, has already been indexed."""
+        stat = os.stat(indata)
+        row = self.db.execute("SELECT size, mtime_ns FROM sources "
+                              "WHERE path = ?",
+                              (str(Path(indata).resolve()),)).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns)
+
+    def update(self, indata, threads=1):
+        """Add the records of the json download indata (compressed with
+        any codec input_lines reads).
+
+        Returns the number of records read, 0 if indata was already
+        indexed.
+        """
+        from .codec import input_lines
+        if self.is_current(indata):
+            return 0
+        source = str(Path(indata).resolve())
+        stat   = os.stat(indata)
+        offset = 0
+        count  = 0
+        batch  = []
+        with self.db:
+            # offsets into the file as it was before are no longer valid
+            self.db.execute("DELETE FROM records WHERE source = ?",
+                            (source,))
+            for line in input_lines(indata, threads):
+                name, accession = name_and_accession(line)
+                batch.append((name, accession, source, offset))
+                offset += len(line)
+                count  += 1
+                if len(batch) >= BATCH:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+            indexed = self.db.execute("SELECT COALESCE(MAX(indexed), 0) + 1 "
+                                      "FROM sources").fetchone()[0]
+            self.db.execute("INSERT OR REPLACE INTO sources "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (source, stat.st_size, stat.st_mtime_ns, count,
+                             indexed))
+        return count
+
+    def _insert(self, batch):
+        self.db.executemany("INSERT OR REPLACE INTO records "
+                            "VALUES (?, ?, ?, ?)", batch)
+
+    def lookup(self, names):
+        """Return a DataFrame of covv_accession_id indexed by the
+        covv_virus_name of each indexed name in names."""
+        import pandas as pd
+        names = list(dict.fromkeys(names))
+        rows  = []
+        for start in range(0, len(names), LOOKUP):
+            chunk = names[start:start + LOOKUP]
+            rows += self.db.execute(
+                "SELECT covv_virus_name, covv_accession_id FROM records "
+                "JOIN sources ON records.source = sources.path "
+                f"WHERE covv_virus_name IN ({', '.join('?' * len(chunk))}) "
+                "ORDER BY sources.indexed", chunk).fetchall()
+        df = pd.DataFrame(rows, columns=["covv_virus_name",
+                                         "covv_accession_id"])
+        # the last download indexed wins
+        df.drop_duplicates("covv_virus_name", keep="last", inplace=True)
+        df.set_index("covv_virus_name", inplace=True)
+        df.index.name = None
+        return df
+
+    def record(self, name):
+        """Return the full json record of name from the last download
+        indexed with it, or None if name is not indexed.
+
+        Only a seekable zstd download (see gnb convert) is read from the
+        record's frame; any other is decompressed from its start up to
+        the record, so this takes time in proportion to the download.
+        """
+        from .codec import line_at
+        row = self.db.execute("SELECT source, offset FROM records "
+                              "JOIN sources ON records.source = sources.path "
+                              "WHERE covv_virus_name = ? "
+                              "ORDER BY sources.indexed DESC LIMIT 1",
+                              (name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(line_at(row[0], row[1]))
@@ -0,0 +1,86 @@
+"""
+    This module merges many GISAID upload sheets against a single load of
+    the GISAID download and NCBI template.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+from pathlib import Path
+
+MANIFEST_COLUMNS = ["GISAID_upload", "BioProject", "output"]
+_SHARED = {}
+
+
+def read_manifest(path):
+    """Return the manifest rows as dicts, with paths resolved relative to
+    the manifest."""
+    import pandas as pd
+    df = pd.read_csv(path, sep="\t", dtype=str, comment="#")
+    missing = [col for col in MANIFEST_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Manifest {path} is missing columns: "
+                         f"{', '.join(missing)}")
+    base = Path(path).parent
+    return [{"GISAID_upload": base / row["GISAID_upload"],
+             "BioProject"   : row["BioProject"],
+             "output"       : base / row["output"]}
+            for row in df[MANIFEST_COLUMNS].to_dict("records")]
+
+
+def _init_worker(shared):
+    _SHARED.update(shared)
+
+
+def merge_entry(entry):
+    """Merge one manifest entry against the shared tables and write its
+    TSV.  Returns the number of rows written."""
+    from .table_maker import Table, merge_biosample_dfs, UPLOAD_COLUMNS
+    from .writer import TSVWriter
+    replacement = _SHARED["replacement"]
+    gisaidup = Table(entry["GISAID_upload"]).gisaid_template(replacement,
+                                                            UPLOAD_COLUMNS)
+    gisaidjson = _SHARED["gisaidjson"]
+    if gisaidjson is None:
+        from .accession_index import AccessionIndex
+        with AccessionIndex(_SHARED["index"]) as index:
+            gisaidjson = index.lookup(gisaidup.index)
+        gisaidjson.replace("unknown", replacement, inplace=True)
+    merged = merge_biosample_dfs(_SHARED["ncbiup"], gisaidup, gisaidjson,
+                                 entry["BioProject"], replacement)
+    with TSVWriter(entry["output"]) as writer:
+        writer.write(merged)
+    return merged.shape[0]
+
+
+def run_batch(entries, ncbiup, replacement, gisaidjson=None, index=None,
+              workers=1):
+    """Merge each manifest entry, yielding (entry, rows written) or
+    (entry, exception) in manifest order.
+
+    ncbiup and either the parsed gisaidjson or an accession index path are
+    handed to each worker process once, not once per entry.
+    """
+    shared = {"ncbiup": ncbiup, "replacement": replacement,
+              "gisaidjson": gisaidjson, "index": index}
+    if workers <= 1:
+        _init_worker(shared)
+        for entry in entries:
+            try:
+                yield entry, merge_entry(entry)
+            except Exception as error:
+                yield entry, error
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(shared,)) as executor:
+        futures = [(entry, executor.submit(merge_entry, entry))
+                   for entry in entries]
+        for entry, future in futures:
+            try:
+                yield entry, future.result()
+            except Exception as error:
+                yield entry, error
@@ -0,0 +1,246 @@
+"""
+    This module generates synthetic GISAID/NCBI inputs and times the
+    table building stages on them.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import bz2
+import csv
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+SIZES = [10000, 1000000, 10000000]
+REGEX = r"Australia|Timor\-Leste|Oceania"
+# roughly the share of each location in a global GISAID download
+LOCATIONS = {"Europe / United Kingdom / England": 0.30,
+             "North America / USA / California": 0.25,
+             "Europe / Germany / Bavaria": 0.08,
+             "Europe / Denmark / Hovedstaden": 0.07,
+             "Asia / Japan / Tokyo": 0.05,
+             "Europe / France / Ile-de-France": 0.04,
+             "North America / Canada / Ontario": 0.04,
+             "South America / Brazil / Sao Paulo": 0.04,
+             "Asia / India / Maharashtra": 0.04,
+             "Europe / Spain / Madrid": 0.03,
+             "Africa / South Africa / Gauteng": 0.02,
+             "Asia / Israel / Tel Aviv": 0.02,
+             "Oceania / Australia / Victoria": 0.006,
+             "Oceania / Australia / New South Wales": 0.003,
+             "Oceania / New Zealand / Auckland": 0.0008,
+             "Asia / Timor-Leste / Dili": 0.0002}
+TECHNOLOGIES = ["Illumina NextSeq 550", "Illumina iSeq",
+                "Illumina NextSeq 500"]
+UPLOAD_HEADER = ["submitter", "fn", "covv_virus_name", "covv_type",
+                 "covv_passage", "covv_collection_date", "covv_location",
+                 "covv_add_location", "covv_host", "covv_add_host_info",
+                 "covv_gender", "covv_patient_age", "covv_patient_status",
+                 "covv_specimen", "covv_outbreak", "covv_last_vaccinated",
+                 "covv_treatment", "covv_seq_technology",
+                 "covv_assembly_method", "covv_coverage", "covv_orig_lab",
+                 "covv_orig_lab_addr", "covv_provider_sample_id",
+                 "covv_subm_lab", "covv_subm_lab_addr", "covv_subm_sample_id",
+                 "covv_authors", "covv_comment", "comment_type"]
+UPLOAD_LABELS = ["Submitter", "FASTA filename", "Virus name", "Type",
+                 "Passage details/history", "Collection date", "Location",
+                 "Additional location information", "Host",
+                 "Additional host information", "Gender", "Patient age",
+                 "Patient status", "Specimen source", "Outbreak",
+                 "Last vaccinated", "Treatment", "Sequencing technology",
+                 "Assembly method", "Coverage", "Originating lab", "Address",
+                 "Sample ID given by the sample provider", "Submitting lab",
+                 "Address", "Sample ID given by the submitting laboratory",
+                 "Authors", "Comment", "Comment Icon"]
+ATTRIBUTES_HEADER = ["accession", "message", "sample_name", "sample_title",
+                     "organism", "strain", "isolate"]
+
+
+def synthetic_records(nrecords, seed=0):
+    """Yield nrecords GISAID download style records."""
+    rng = random.Random(seed)
+    locations = list(LOCATIONS)
+    weights   = list(LOCATIONS.values())
+    for i in range(nrecords):
+        location = rng.choices(locations, weights)[0]
+        country  = location.split(" / ")[1].replace(" ", "")
+        yield {"covv_virus_name": f"hCoV-19/{country}/S{i}/2021",
+               "covv_accession_id": f"EPI_ISL_{i + 400000}",
+               "covv_collection_date": f"2021-{rng.randint(1, 12):02d}-"
+                                       f"{rng.randint(1, 28):02d}",
+               "covv_location": location,
+               "covv_host": "Human",
+               "covv_gender": rng.choice(["Male", "Female", "unknown"]),
+               "covv_patient_age": rng.choice(["unknown",
+                                               str(rng.randint(0, 99))]),
+               "covv_passage": "Original",
+               "covv_specimen": "",
+               "covv_seq_technology": rng.choice(TECHNOLOGIES),
+               "covv_orig_lab": f"Lab {rng.randint(1, 500)}",
+               "covv_subm_lab": f"Lab {rng.randint(1, 100)}",
+               "covv_lineage": rng.choice(["B.1.1.7", "B.1.617.2", "AY.4",
+                                           "P.1", "B.1.351"]),
+               "sequence_length": rng.randint(29000, 29903),
+               "covv_add_host_info": ""}
+
+
+def write_synthetic(workdir, nrecords, seed=0):
+    """Write metadata.json.bz2, a GISAID upload sheet (csv) of the
+    Oceania records and the matching BioSample attributes.tsv for
+    nrecords records under workdir, unless they exist already.
+
+    Returns a dict of the paths.
+    """
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    stem  = f"synthetic_{nrecords}_{seed}"
+    paths = {"GISAID_json": workdir / f"{stem}.metadata.json.bz2",
+             "GISAID_upload": workdir / f"{stem}.upload.csv",
+             "attributes": workdir / f"{stem}.attributes.tsv"}
+    if all(path.is_file() for path in paths.values()):
+        return paths
+    tmp = {key: path.with_name(path.name + ".tmp")
+           for key, path in paths.items()}
+    with bz2.open(tmp["GISAID_json"], "wt") as download, \
+         open(tmp["GISAID_upload"], "w", newline="") as upload, \
+         open(tmp["attributes"], "w", newline="") as attributes:
+        upload = csv.writer(upload)
+        upload.writerow(UPLOAD_HEADER)
+        upload.writerow(UPLOAD_LABELS)
+        attributes = csv.writer(attributes, delimiter="\t")
+        attributes.writerow(ATTRIBUTES_HEADER)
+        for count, record in enumerate(synthetic_records(nrecords, seed)):
+            download.write(json.dumps(record) + "\n")
+            if "Oceania" not in record["covv_location"] and \
+               "Timor-Leste" not in record["covv_location"]:
+                continue
+            name    = record["covv_virus_name"]
+            isolate = name.split("/")[2]
+            row = dict.fromkeys(UPLOAD_HEADER, "")
+            row.update({key: value for key, value in record.items()
+                        if key in row})
+            row.update({"submitter": "Bench Mark", "fn": "all.fasta",
+                        "covv_type": "betacoronavirus",
+                        "covv_assembly_method": "ARTIC V3 amplicons",
+                        "covv_coverage": "1000x",
+                        "covv_authors": "Bench M."})
+            upload.writerow(row.values())
+            attributes.writerow([f"SAMN{count}", "Successfully loaded", name,
+                                 f"SARS-CoV-2 {isolate}",
+                                 "Severe acute respiratory syndrome "
+                                 "coronavirus 2", "", isolate])
+    for key, path in paths.items():
+        tmp[key].replace(path)
+    return paths
+
+
+def _setup_gisaid_json(paths):
+    from .table_maker import Table
+    return lambda: Table(paths["GISAID_json"]).gisaid_json("missing", None,
+                                                           REGEX)
+
+
+def _setup_merge_biosample_dfs(paths):
+    from .. import resource_filename, __test_NCBI_up__
+    from .table_maker import Table, merge_biosample_dfs, UPLOAD_COLUMNS
+    ncbiup = Table(resource_filename(__test_NCBI_up__)).ncbi_template()
+    gisaidup = Table(paths["GISAID_upload"]).gisaid_template("missing",
+                                                            UPLOAD_COLUMNS)
+    gisaidjson = Table(paths["GISAID_json"]).gisaid_json(
+        "missing", None, REGEX, columns=["covv_accession_id"])
+    return lambda: merge_biosample_dfs(ncbiup, gisaidup, gisaidjson,
+                                       "PRJNA000000", "missing")
+
+
+def _setup_sra_builder(paths):
+    from .. import resource_filename, __test_SRA_up__
+    from .sra_builder import SRA_table, UPLOAD_COLUMNS
+    gisaid_up = SRA_table().read_gisaid_metadata(paths["GISAID_upload"],
+                                                 UPLOAD_COLUMNS)
+    attributes = SRA_table().bsmpl_attributes(paths["attributes"])
+    template = resource_filename(__test_SRA_up__)
+    return lambda: SRA_table().sra_builder(gisaid_up.copy(),
+                                           attributes.copy(),
+                                           SRA_table().sra_template(template))
+
+
+STAGES = {"gisaid_json": _setup_gisaid_json,
+          "merge_biosample_dfs": _setup_merge_biosample_dfs,
+          "sra_builder": _setup_sra_builder}
+
+
+def _run_stage(stage, paths, trace, conn):
+    from .profiler import max_rss_mb
+    try:
+        run = STAGES[stage](paths)
+        rss_before = max_rss_mb()
+        wall = time.perf_counter()
+        cpu  = time.process_time()
+        df   = run()
+        result = {"wall_s": time.perf_counter() - wall,
+                  "cpu_s": time.process_time() - cpu,
+                  "max_rss_mb_before": rss_before,
+                  "max_rss_mb": max_rss_mb(),
+                  "rows": int(df.shape[0])}
+        if trace:
+            import tracemalloc
+            del df
+            tracemalloc.start()
+            run()
+            result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / \
+                                       (1 << 20)
+            tracemalloc.stop()
+        conn.send(result)
+    except Exception as error:
+        conn.send({"error": repr(error)})
+    finally:
+        conn.close()
+
+
+def run_bench(workdir, sizes=SIZES, stages=tuple(STAGES), seed=0,
+              trace=False, log=sys.stderr):
+    """Time each stage on synthetic data of each size.
+
+    Each stage runs in a fresh process, so max_rss_mb is the peak of that
+    stage and its setup alone; max_rss_mb_before is the peak once setup is
+    done.  With trace, the stage is run a second time under tracemalloc
+    for the peak of memory allocated by the stage itself.  Returns a dict
+    ready for json.dump.
+    """
+    import multiprocessing
+    import platform
+    import pandas as pd
+    from .. import __version__
+    results = []
+    for nrecords in sizes:
+        print(f"Generating {nrecords} records", file=log)
+        paths = write_synthetic(workdir, nrecords, seed)
+        for stage in stages:
+            recv, send = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_run_stage,
+                                           args=(stage, paths, trace, send))
+            proc.start()
+            send.close()
+            try:
+                result = recv.recv()
+            except EOFError:
+                # the stage died without reporting, e.g. killed out of memory
+                proc.join()
+                result = {"error": f"exit {proc.exitcode}"}
+            proc.join()
+            result.update({"records": nrecords, "stage": stage})
+            print(json.dumps(result), file=log)
+            results.append(result)
+    return {"gnb_version": __version__,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seed": seed,
+            "results": results}
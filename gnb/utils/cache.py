@@ -0,0 +1,156 @@
+"""
+    This module keeps parsed GISAID downloads as Feather files, so repeat
+    runs against the same metadata.json.bz2 skip decompression and parsing.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+CACHE_DIR   = ".gnb_cache"
+INDEX_NAME  = "__gnb_index__"
+HASHES      = "fingerprints.json"
+
+
+def fingerprint(path, chunk_size=1 << 20):
+    """Return (size, mtime_ns, blake2b hex digest) of the file at path."""
+    stat   = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+class GisaidCache():
+    """A directory of Feather tables keyed by input fingerprint and the
+    arguments used to parse the input.
+
+    Entries are evicted least recently used first once there are more than
+    max_entries of them or they take up more than max_bytes.
+    """
+    def __init__(self, cache_dir, max_entries=8, max_bytes=None):
+        self.cache_dir   = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+
+    @classmethod
+    def beside(cls, indata, **kwargs):
+        """The cache in a .gnb_cache directory next to indata."""
+        return cls(Path(indata).parent / CACHE_DIR, **kwargs)
+
+    @staticmethod
+    def available():
+        try:
+            import pyarrow.feather
+        except ImportError:
+            return False
+        return True
+
+    def _hash(self, path):
+        """Hash path, reusing the last hash if size, mtime and inode are
+        unchanged."""
+        stat  = os.stat(path)
+        known = {}
+        index = self.cache_dir / HASHES
+        if index.is_file():
+            with open(index) as handle:
+                known = json.load(handle)
+        name = str(Path(path).resolve())
+        stamp = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        if name in known and known[name][:3] == stamp:
+            return known[name][3]
+        digest = fingerprint(path)[2]
+        known[name] = stamp + [digest]
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = index.with_suffix(".tmp")
+        with open(tmp, "w") as handle:
+            json.dump(known, handle)
+        os.replace(tmp, index)
+        return digest
+
+    def key(self, path, **params):
+        """Key for the table parsed from path with params."""
+        from .. import __version__
+        stat = os.stat(path)
+        text = json.dumps([__version__, stat.st_size, stat.st_mtime_ns,
+                           self._hash(path), params], sort_keys=True,
+                          default=str)
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.feather"
+
+    def load(self, key):
+        """Return the cached DataFrame for key, or None.  An entry that
+        cannot be read (e.g. truncated) is removed, so it is rebuilt."""
+        import pyarrow as pa
+        from pyarrow import feather
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        try:
+            df = feather.read_table(path).to_pandas()
+        except (pa.ArrowException, ValueError):
+            path.unlink()
+            return None
+        df.set_index(INDEX_NAME, inplace=True)
+        df.index.name = None
+        os.utime(path)
+        return df
+
+    def store(self, key, df):
+        """Write df under key, then evict old entries."""
+        import pyarrow as pa
+        from pyarrow import feather
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        table = df.rename_axis(INDEX_NAME).reset_index()
+        for col in table.columns[table.dtypes == object]:
+            try:
+                pa.array(table[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # mixed types within a column, kept as their text
+                table[col] = table[col].map(str).where(table[col].notna())
+        for col in table.columns[table.dtypes == "category"]:
+            try:
+                pa.array(table[col].cat.categories, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # mixed types within the categories, kept as their text
+                table[col] = table[col].astype(object).map(str) \
+                                       .where(table[col].notna()) \
+                                       .astype("category")
+        path = self._path(key)
+        tmp  = path.with_suffix(".tmp")
+        feather.write_feather(table, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the limits."""
+        entries = sorted(self.cache_dir.glob("*.feather"),
+                         key=lambda path: path.stat().st_mtime, reverse=True)
+        total = 0
+        for count, path in enumerate(entries):
+            total += path.stat().st_size
+            if count >= self.max_entries or \
+               (self.max_bytes is not None and total > self.max_bytes):
+                path.unlink()
+
+
+def open_cache(indata, cache_dir=None, enabled=False, max_entries=8):
+    """The GisaidCache to use for indata, keeping at most max_entries
+    tables, or None if caching is not switched on (by enabled or a
+    cache_dir) or pyarrow is not installed."""
+    if not (enabled or cache_dir is not None) or \
+       not GisaidCache.available():
+        return None
+    if cache_dir is None:
+        return GisaidCache.beside(indata, max_entries=max_entries)
+    return GisaidCache(cache_dir, max_entries=max_entries)
@@ -0,0 +1,392 @@
+"""
+    This module opens the GISAID download whatever it is compressed with,
+    and writes and reads seekable (frame indexed) zstd.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import io
+import os
+import struct
+from pathlib import Path
+
+ZSTD_MAGIC     = b"\x28\xb5\x2f\xfd"
+SKIPPABLE      = 0x184D2A5E  # skippable frame holding the seek table
+SEEKABLE_MAGIC = 0x8F92EAB1  # ends the seek table footer
+FOOTER         = struct.Struct("<IBI")
+# decompressed bytes per frame written by convert
+FRAME_SIZE     = 1 << 20
+JSON_MEMBERS   = (".json", ".jsonl", ".ndjson")
+
+
+class Codec():
+    """A compressed input format: the bytes its files start with, how to
+    open one (a path or a binary file object) as a binary file object, and
+    optionally a faster way to read the lines of a path with more than one
+    thread."""
+    def __init__(self, name, magic, opener, lines=None):
+        self.name   = name
+        self.magic  = magic
+        self.opener = opener
+        self.lines  = lines
+
+
+CODECS = {}
+
+
+def register(name, magic, opener, lines=None):
+    """Add (or replace) the codec for files starting with magic.
+    opener(path) returns a binary file object of the decompressed data, and
+    must leave a file object passed as path open when closed;
+    lines(path, threads), if given, yields the lines of a path."""
+    CODECS[name] = Codec(name, magic, opener, lines)
+
+
+def _bz2_open(path):
+    import bz2
+    return bz2.BZ2File(path, "r")
+
+
+def _bz2_lines(path, threads):
+    from .decompress import bz2_lines
+    return bz2_lines(path, threads)
+
+
+def _gzip_open(path):
+    import gzip
+    return gzip.open(path, "rb")
+
+
+def _xz_open(path):
+    import lzma
+    return lzma.open(path, "rb")
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing zstd needs the zstandard "
+                          "package (pip install zstandard)") from None
+    return zstandard
+
+
+def _zstd_open(path):
+    owned  = _is_path(path)
+    reader = _zstandard().ZstdDecompressor().stream_reader(
+        open(path, "rb") if owned else path, read_across_frames=True,
+        closefd=owned)
+    return io.BufferedReader(reader)
+
+
+def _zstd_lines(path, threads):
+    seekable = SeekableZstd.open(path)
+    if seekable is None:
+        return _file_lines(_zstd_open(path))
+    return seekable.lines(threads=threads)
+
+
+register("bz2", b"BZh", _bz2_open, _bz2_lines)
+register("gzip", b"\x1f\x8b", _gzip_open)
+register("xz", b"\xfd7zXZ\x00", _xz_open)
+register("zstd", ZSTD_MAGIC, _zstd_open, _zstd_lines)
+
+
+def _is_path(data):
+    return isinstance(data, (str, os.PathLike))
+
+
+def _source(data):
+    """data, with bytes as a binary file object."""
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(data)
+    return data
+
+
+def detect(path):
+    """The name of the codec of the file at path (or of a seekable binary
+    file object, from its current position, or of bytes), or 'plain'."""
+    path = _source(path)
+    if _is_path(path):
+        with open(path, "rb") as handle:
+            head = handle.read(8)
+    else:
+        pos  = path.tell()
+        head = path.read(8)
+        path.seek(pos)
+    for codec in sorted(CODECS.values(), key=lambda codec: -len(codec.magic)):
+        if head.startswith(codec.magic):
+            return codec.name
+    if len(head) >= 4 and head[0] & 0xF0 == 0x50 and \
+       head[1:4] == b"\x2a\x4d\x18":
+        return "zstd"  # starts with a skippable frame
+    return "plain"
+
+
+def _is_tar(head):
+    return len(head) >= 262 and head[257:262] == b"ustar"
+
+
+def _open(path, codec):
+    if codec == "plain":
+        return open(path, "rb") if _is_path(path) else path
+    return CODECS[codec].opener(path)
+
+
+def _is_tar_input(path, codec):
+    if _is_path(path):
+        with _open(path, codec) as handle:
+            return _is_tar(handle.read(512))
+    pos = path.tell()
+    # not closed, as that would close path when it is plain
+    tar = _is_tar(_open(path, codec).read(512))
+    path.seek(pos)
+    return tar
+
+
+def _tar_member(handle, path):
+    """The first json member of the tar stream handle, as a file object."""
+    import tarfile
+    archive = tarfile.open(fileobj=handle, mode="r|")
+    for member in archive:
+        if member.isfile() and member.name.endswith(JSON_MEMBERS):
+            return archive.extractfile(member)
+    raise OSError(f"No {', '.join(JSON_MEMBERS)} member in {path}")
+
+
+def open_input(path):
+    """A binary file object of the decompressed GISAID download at path
+    (or in bytes or a seekable binary file object); of its first json
+    member if it is a (compressed) tar archive.  A plain file object is
+    returned as it is."""
+    path  = _source(path)
+    codec = detect(path)
+    tar   = _is_tar_input(path, codec)
+    handle = _open(path, codec)
+    if tar:
+        return _tar_member(handle, path)
+    return handle
+
+
+def _file_lines(handle):
+    with handle:
+        yield from handle
+
+
+def input_lines(path, threads=1):
+    """Yield the decompressed lines of the GISAID download at path (or in
+    bytes or a seekable binary file object, which is left open).
+
+    The codec is detected from the first bytes of the file.  bz2 and
+    seekable zstd files are decompressed by threads cores where they can
+    be.
+    """
+    path  = _source(path)
+    codec = detect(path)
+    if _is_path(path) and codec != "plain" and \
+       CODECS[codec].lines is not None and not _is_tar_input(path, codec):
+        return CODECS[codec].lines(path, threads)
+    handle = open_input(path)
+    if handle is path:
+        return iter(handle)
+    return _file_lines(handle)
+
+
+def line_at(path, offset):
+    """The line starting at decompressed offset in the download at path."""
+    seekable = SeekableZstd.open(path) if detect(path) == "zstd" else None
+    if seekable is not None:
+        return seekable.line_at(offset)
+    with open_input(path) as handle:
+        handle.seek(offset)
+        return handle.readline()
+
+
+class SeekableZstd():
+    """The frame index of a zstd file in the seekable format: frames of
+    their own, with a seek table of the compressed and decompressed size
+    of each frame in a skippable frame at the end.
+
+    frames holds (offset, compressed size, decompressed offset,
+    decompressed size) for each frame, so any frame can be decompressed
+    on its own and a reader can start at any of them.
+    """
+    def __init__(self, path):
+        self.path   = Path(path)
+        self.frames = []
+        with open(path, "rb") as handle:
+            handle.seek(0, os.SEEK_END)
+            size = handle.tell()
+            if size < FOOTER.size + 8:
+                raise ValueError(f"No zstd seek table in {path}")
+            handle.seek(size - FOOTER.size)
+            nframes, descriptor, magic = FOOTER.unpack(
+                handle.read(FOOTER.size))
+            if magic != SEEKABLE_MAGIC:
+                raise ValueError(f"No zstd seek table in {path}")
+            entry = 12 if descriptor & 0x80 else 8
+            table = nframes * entry + FOOTER.size
+            handle.seek(size - table - 8)
+            skippable, length = struct.unpack("<II", handle.read(8))
+            if skippable != SKIPPABLE or length != table:
+                raise ValueError(f"Bad zstd seek table in {path}")
+            entries = handle.read(nframes * entry)
+        offset = start = 0
+        for pos in range(0, len(entries), entry):
+            compressed, decompressed = struct.unpack_from("<II", entries, pos)
+            self.frames.append((offset, compressed, start, decompressed))
+            offset += compressed
+            start  += decompressed
+        self.size = start
+
+    @classmethod
+    def open(cls, path):
+        """The SeekableZstd of path, or None if it has no seek table (or is
+        not a path)."""
+        if not _is_path(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def frame(self, number, handle):
+        """The decompressed bytes of frame number, read from handle."""
+        offset, compressed, start, size = self.frames[number]
+        handle.seek(offset)
+        return _zstandard().ZstdDecompressor().decompress(
+            handle.read(compressed), max_output_size=size)
+
+    def frame_at(self, offset):
+        """The number of the frame holding decompressed offset."""
+        starts = [frame[2] for frame in self.frames]
+        return bisect.bisect_right(starts, offset) - 1
+
+    def line_at(self, offset):
+        """The line starting at decompressed offset."""
+        number = self.frame_at(offset)
+        with open(self.path, "rb") as handle:
+            data = self.frame(number, handle)[offset -
+                                              self.frames[number][2]:]
+            while not data.endswith(b"\n") and number + 1 < len(self.frames):
+                number += 1
+                data += self.frame(number, handle)
+        return data.split(b"\n", 1)[0] + b"\n" if b"\n" in data else data
+
+    def lines(self, first=0, stop=None, threads=1):
+        """Yield the lines starting in frames [first, stop).
+
+        A line cut by a frame boundary belongs to the frame it starts in,
+        so readers of neighbouring frame ranges see each line once.  With
+        threads > 1, frames are decompressed that many at a time.
+        """
+        stop = len(self.frames) if stop is None else stop
+        if first >= stop:
+            return
+        with open(self.path, "rb") as handle:
+            skip = first > 0 and not self.frame(first - 1, handle) \
+                                         .endswith(b"\n")
+            tail = b""
+            for data in self._frames(first, stop, handle, threads):
+                if skip:
+                    cut = data.find(b"\n")
+                    if cut == -1:
+                        continue
+                    data = data[cut + 1:]
+                    skip = False
+                lines = io.BytesIO(tail + data).readlines()
+                tail = b""
+                if lines and not lines[-1].endswith(b"\n"):
+                    tail = lines.pop()
+                yield from lines
+            number = stop
+            while tail and number < len(self.frames):
+                data = self.frame(number, handle)
+                cut  = data.find(b"\n")
+                if cut != -1:
+                    yield tail + data[:cut + 1]
+                    return
+                tail += data
+                number += 1
+            if tail:
+                yield tail
+
+    def _frames(self, first, stop, handle, threads):
+        if threads <= 1:
+            for number in range(first, stop):
+                yield self.frame(number, handle)
+            return
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        decompress = _zstandard().ZstdDecompressor
+
+        def read(number):
+            offset, compressed, start, size = self.frames[number]
+            with open(self.path, "rb") as frame:
+                frame.seek(offset)
+                return decompress().decompress(frame.read(compressed),
+                                               max_output_size=size)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = deque()
+            for number in range(first, stop):
+                pending.append(executor.submit(read, number))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def batches(self, size):
+        """Split the frames into ranges (first, stop) of about size
+        decompressed bytes."""
+        batches = []
+        first = total = 0
+        for number, frame in enumerate(self.frames):
+            total += frame[3]
+            if total >= size:
+                batches.append((first, number + 1))
+                first = number + 1
+                total = 0
+        if first < len(self.frames):
+            batches.append((first, len(self.frames)))
+        return batches
+
+
+def convert(path, output, frame_size=FRAME_SIZE, level=3, threads=1):
+    """Re-encode the GISAID download at path as seekable zstd at output.
+
+    Each frame holds whole lines, about frame_size decompressed bytes of
+    them.  Returns the number of frames written.
+    """
+    compressor = _zstandard().ZstdCompressor(level=level)
+    output = Path(output)
+    if output.exists() and output.resolve() == Path(path).resolve():
+        raise ValueError(f"Cannot convert {path} onto itself")
+    entries = []
+    tmp = output.with_name(output.name + ".tmp")
+    with open(tmp, "wb") as out:
+        def flush(lines):
+            data = b"".join(lines)
+            frame = compressor.compress(data)
+            out.write(frame)
+            entries.append((len(frame), len(data)))
+        lines = []
+        size = 0
+        for line in input_lines(path, threads):
+            lines.append(line)
+            size += len(line)
+            if size >= frame_size:
+                flush(lines)
+                lines = []
+                size = 0
+        if lines:
+            flush(lines)
+        table = b"".join(struct.pack("<II", *entry) for entry in entries) + \
+                FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+        out.write(struct.pack("<II", SKIPPABLE, len(table)) + table)
+    os.replace(tmp, output)
+    return len(entries)
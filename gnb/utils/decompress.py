@@ -0,0 +1,228 @@
+"""
+    This module reads lines from the bz2 compressed GISAID download, using
+    more than one core where it can.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import bz2
+import io
+import os
+import shutil
+from collections import deque
+from subprocess import Popen, PIPE
+
+BLOCK_MAGIC = 0x314159265359  # pi, starts each compressed block
+EOS_MAGIC   = 0x177245385090  # sqrt(pi), ends each bz2 stream
+EXTERNAL    = {"lbzip2": "-n", "pbzip2": "-p"}
+SCAN_WINDOW = 1 << 26
+
+
+def _marker_patterns():
+    """For each bit shift, the five whole bytes of a marker, and the
+    value/mask to check the seven bytes that hold it."""
+    patterns = []
+    for magic in (BLOCK_MAGIC, EOS_MAGIC):
+        for shift in range(8):
+            value = magic << (8 - shift)
+            mask  = ((1 << 48) - 1) << (8 - shift)
+            patterns.append((magic, shift, value.to_bytes(7, "big")[1:6],
+                             value, mask))
+    return patterns
+
+
+PATTERNS = _marker_patterns()
+
+
+def bz2_markers(data, window=SCAN_WINDOW):
+    """Yield (bit_offset, magic) for each block and end-of-stream marker in
+    data, in file order.
+
+    Markers are not byte aligned, so each of the eight bit shifts is
+    searched for.  The same bit pattern can occur by chance inside the
+    compressed data; bz2_blocks deals with those.
+    """
+    size = len(data)
+    for start in range(0, size, window):
+        stop  = min(start + window, size)
+        chunk = data[start:min(stop + 7, size)]
+        found = []
+        for magic, shift, key, value, mask in PATTERNS:
+            pos = chunk.find(key, 1)
+            while pos != -1 and start + pos - 1 < stop:
+                word = chunk[pos - 1:pos + 6].ljust(7, b"\0")
+                if int.from_bytes(word, "big") & mask == value:
+                    found.append(((start + pos - 1) * 8 + shift, magic))
+                pos = chunk.find(key, pos + 1)
+        yield from sorted(found)
+
+
+def bz2_segments(data):
+    """Yield (start, magic, end) for the bits from each marker to the next."""
+    previous = None
+    for offset, magic in bz2_markers(data):
+        if previous is not None:
+            yield previous + (offset,)
+        previous = (offset, magic)
+    if previous is not None and previous[1] == BLOCK_MAGIC:
+        raise EOFError("Compressed file ended before the end-of-stream "
+                       "marker was reached")
+
+
+def _segment_bytes(data, start, end):
+    first = start // 8
+    return data[first:(end + 7) // 8], start - first * 8, end - first * 8
+
+
+def decompress_block(data, start, end):
+    """Decompress the block held in bits [start, end) of data.
+
+    The block is wrapped in a stream header and end-of-stream marker of its
+    own.  A one block stream has the block CRC as its stream CRC.  Returns
+    None if the bits are not a whole, valid block.
+    """
+    nbits = end - start
+    if nbits <= 80:
+        return None
+    value = int.from_bytes(data, "big") >> (len(data) * 8 - end)
+    value &= (1 << nbits) - 1
+    crc = (value >> (nbits - 80)) & 0xFFFFFFFF
+    value = (value << 80) | (EOS_MAGIC << 32) | crc
+    nbits += 80
+    pad = -nbits % 8
+    stream = b"BZh9" + (value << pad).to_bytes((nbits + pad) // 8, "big")
+    try:
+        return bz2.decompress(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def bz2_blocks(data, executor, inflight, max_join=4):
+    """Yield the decompressed blocks of data in order, decompressing up to
+    inflight blocks at a time across executor.
+
+    A block that fails to decompress on its own was cut short by a chance
+    marker pattern, so it is joined with the following segments, up to
+    max_join of them, until the joined bits decompress.
+    """
+    queue    = deque()
+    segments = bz2_segments(data)
+    def submit():
+        for start, magic, end in segments:
+            future = None
+            if magic == BLOCK_MAGIC:
+                future = executor.submit(decompress_block,
+                                         *_segment_bytes(data, start, end))
+            queue.append((start, end, future))
+            if len(queue) >= inflight:
+                break
+    pending = None
+    joined  = 0
+    end     = None
+    submit()
+    while queue:
+        start, end, future = queue.popleft()
+        submit()
+        if pending is not None:
+            block = decompress_block(*_segment_bytes(data, pending, start))
+            if block is not None:
+                yield block
+                pending = None
+            elif joined >= max_join:
+                raise OSError("Invalid data stream")
+            else:
+                joined += 1
+        if future is None:
+            continue
+        block = future.result()
+        if block is None:
+            if pending is None:
+                pending = start
+                joined  = 0
+        elif pending is not None:
+            raise OSError("Invalid data stream")
+        else:
+            yield block
+    if pending is not None:
+        block = decompress_block(*_segment_bytes(data, pending, end))
+        if block is None:
+            raise OSError("Invalid data stream")
+        yield block
+
+
+def _split_lines(blocks):
+    tail = b""
+    for block in blocks:
+        lines = io.BytesIO(tail + block).readlines()
+        tail = b""
+        if lines and not lines[-1].endswith(b"\n"):
+            tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def _pool_lines(path, threads):
+    import mmap
+    from concurrent.futures import ProcessPoolExecutor
+    from .scheduler import process_context
+    with open(path, "rb") as handle, \
+         mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+         ProcessPoolExecutor(max_workers=threads,
+                             mp_context=process_context()) as executor:
+        if data[:3] != b"BZh":
+            raise OSError(f"Not a bz2 file: {path}")
+        executor.submit(int).result()
+        yield
+        yield from _split_lines(bz2_blocks(data, executor, threads * 4))
+
+
+def _external_lines(path, program, threads):
+    proc = Popen([program, "-d", "-c", f"{EXTERNAL[program]}{threads}",
+                  os.fspath(path)], stdout=PIPE)
+    with proc:
+        yield
+        yield from proc.stdout
+    if proc.returncode:
+        raise OSError(f"{program} exited with status {proc.returncode}")
+
+
+def _stdlib_lines(path):
+    with bz2.BZ2File(path, "r") as file:
+        yield
+        yield from file
+
+
+def bz2_lines(path, threads=1):
+    """Yield the decompressed lines of the bz2 file at path.
+
+    With more than one thread, blocks are decompressed across a process
+    pool.  If a pool cannot be started, or its workers die on start (as
+    forkserver workers do when the main script was read from stdin), an
+    lbzip2 or pbzip2 on the PATH is used instead, and failing that the
+    single threaded bz2 module.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+    readers = []
+    if threads > 1:
+        readers.append(lambda: _pool_lines(path, threads))
+        for program in EXTERNAL:
+            if shutil.which(program):
+                readers.append(lambda program=program:
+                               _external_lines(path, program, threads))
+    readers.append(lambda: _stdlib_lines(path))
+    for reader in readers[:-1]:
+        lines = reader()
+        try:
+            next(lines)
+        except (OSError, ValueError, ImportError, NotImplementedError,
+                BrokenProcessPool):
+            continue
+        return lines
+    lines = readers[-1]()
+    next(lines)
+    return lines
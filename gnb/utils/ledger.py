@@ -0,0 +1,139 @@
+"""
+    This module keeps a ledger of the BioSample and SRA rows already
+    emitted and accepted, so that later runs can emit only what changed.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    kind       TEXT,
+    virus_name TEXT,
+    digest     TEXT,
+    accession  TEXT,
+    status     TEXT,
+    updated    TEXT,
+    PRIMARY KEY (kind, virus_name)
+);
+"""
+LOOKUP = 500
+
+
+def row_digests(df, *extra):
+    """Return a digest of each row of df (with its index and the values in
+    extra), as a Series of hex strings indexed like df."""
+    import pandas as pd
+    from .table_maker import as_text
+    text = pd.DataFrame({col: as_text(df[col]) for col in df.columns},
+                        index=df.index)
+    for count, value in enumerate(extra):
+        text[f"extra_{count}"] = str(value)
+    hashes = pd.util.hash_pandas_object(text, index=True)
+    return hashes.map("{:016x}".format)
+
+
+def bsmp_digests(gisaidup, gisaidjson, bioproject, unknown):
+    """Digests of the inputs of each merge_biosample_dfs row: the upload
+    sheet row, its GISAID accession, the BioProject and replacement."""
+    return row_digests(gisaidup.join(gisaidjson[["covv_accession_id"]]),
+                       bioproject, unknown)
+
+
+def sra_digests(gisaid_up, biosample_attributes):
+    """Digests of the inputs of each sra_builder row: the upload sheet row
+    and its BioSample attributes."""
+    return row_digests(gisaid_up.join(biosample_attributes,
+                                      rsuffix="_attributes"))
+
+
+class Ledger():
+    """SQLite ledger of the rows emitted per kind ('bsmp' or 'sra') and
+    virus name, with the digest of the inputs each row was built from and
+    whether NCBI has accepted the BioSample.
+
+    With --since-ledger, merge_bsmp and merge_sra build only the rows
+    pending() returns and record() them once written.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.db   = sqlite3.connect(os.fspath(self.path))
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _stored(self, kind, names):
+        names  = list(dict.fromkeys(names))
+        stored = {}
+        for start in range(0, len(names), LOOKUP):
+            chunk = names[start:start + LOOKUP]
+            for name, digest, status in self.db.execute(
+                    "SELECT virus_name, digest, status FROM submissions "
+                    f"WHERE kind = ? AND virus_name IN "
+                    f"({', '.join('?' * len(chunk))})", [kind] + chunk):
+                stored[name] = (digest, status)
+        return stored
+
+    def pending(self, kind, digests):
+        """Return a boolean Series, True for each virus name in the index
+        of digests that is new or whose digest changed.
+
+        A BioSample NCBI accepted outside gnb (no digest recorded) counts
+        as already emitted.
+        """
+        stored = self._stored(kind, digests.index)
+
+        def is_pending(name, digest):
+            if name not in stored:
+                return True
+            old, status = stored[name]
+            if old is None:
+                return status != "accepted"
+            return old != digest
+        return digests.index.to_series(index=digests.index) \
+                      .combine(digests, is_pending).astype(bool)
+
+    def record(self, kind, digests):
+        """Record the rows in digests as emitted."""
+        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO submissions (kind, virus_name, digest, status, "
+                "updated) VALUES (?, ?, ?, 'emitted', ?) "
+                "ON CONFLICT (kind, virus_name) DO UPDATE SET "
+                "digest = excluded.digest, updated = excluded.updated, "
+                "status = CASE WHEN status = 'accepted' THEN status "
+                "ELSE 'emitted' END",
+                [(kind, str(name), digest, now)
+                 for name, digest in digests.items()])
+
+    def accept(self, attributes):
+        """Record the BioSamples in attributes (the attributes.tsv table,
+        indexed by sample_name) that NCBI gave an accession as accepted."""
+        now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        accepted = attributes[attributes["accession"].notnull()]
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO submissions (kind, virus_name, accession, status, "
+                "updated) VALUES ('bsmp', ?, ?, 'accepted', ?) "
+                "ON CONFLICT (kind, virus_name) DO UPDATE SET "
+                "accession = excluded.accession, status = 'accepted', "
+                "updated = excluded.updated",
+                [(str(name), str(accession), now)
+                 for name, accession in accepted["accession"].items()])
+        return accepted.shape[0]
@@ -0,0 +1,90 @@
+"""
+    This module reads the spreadsheet and delimited inputs, picking the
+    reader from the file contents rather than trying one after another.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import functools
+import io
+import os
+from importlib.util import find_spec
+from pathlib import Path
+
+MAGIC = {b"PK\x03\x04": "xlsx",
+         b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1": "xls"}
+
+
+def sniff(indata):
+    """Return 'xlsx', 'xls' or 'csv' from the first bytes of indata (a
+    path, bytes or a binary file object)."""
+    if isinstance(indata, (bytes, bytearray)):
+        head = bytes(indata[:8])
+    elif hasattr(indata, "read"):
+        pos  = indata.tell()
+        head = indata.read(8)
+        indata.seek(pos)
+    else:
+        with open(indata, "rb") as handle:
+            head = handle.read(8)
+    for magic, kind in MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return "csv"
+
+
+def excel_engine(kind):
+    """The fastest installed pandas engine for kind ('xlsx' or 'xls')."""
+    import pandas as pd
+    version = tuple(int(part) for part in pd.__version__.split(".")[:2])
+    if find_spec("python_calamine") and version >= (2, 2):
+        return "calamine"
+    if kind == "xls":
+        return "xlrd"
+    if find_spec("openpyxl"):
+        return "openpyxl"
+    raise ImportError("Reading xlsx needs openpyxl or python-calamine "
+                      "(pip install openpyxl)")
+
+
+def read_table(indata, sheet_name=0, header=0, skiprows=None, usecols=None,
+               sep=","):
+    """Read a sheet of an Excel workbook, or a delimited text file, as a
+    DataFrame.  indata is a path, bytes or a binary file object."""
+    import pandas as pd
+    if isinstance(indata, (bytes, bytearray)):
+        indata = io.BytesIO(indata)
+    kind = sniff(indata)
+    if kind == "csv":
+        return pd.read_csv(indata, header=header, sep=sep, skiprows=skiprows,
+                           usecols=usecols)
+    return pd.read_excel(indata, sheet_name=sheet_name, header=header,
+                         skiprows=skiprows, usecols=usecols,
+                         engine=excel_engine(kind))
+
+
+def read_template(indata, **kwargs):
+    """read_table for inputs that rarely change, such as the NCBI and SRA
+    templates.
+
+    Parsed tables are kept in memory for the rest of the process, keyed
+    by the file's path, size, mtime and the read arguments, and a copy is
+    returned each time.  Bytes and file objects are read each time.
+    """
+    if not isinstance(indata, (str, os.PathLike)):
+        return read_table(indata, **kwargs)
+    stat = os.stat(indata)
+    return _read_template(str(Path(indata).resolve()), stat.st_size,
+                          stat.st_mtime_ns,
+                          tuple(sorted((key, repr(value))
+                                       for key, value in kwargs.items())),
+                          **kwargs).copy()
+
+
+@functools.lru_cache(maxsize=32)
+def _read_template(path, size, mtime_ns, key, **kwargs):
+    return read_table(path, **kwargs)
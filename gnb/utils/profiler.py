@@ -0,0 +1,200 @@
+"""
+    This module records the wall time, CPU time, peak memory and record
+    counts of each stage of a run.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import sys
+import threading
+import time
+
+HOOKS = ["cprofile", "tracemalloc"]
+
+
+def max_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+
+class Profiler():
+    """Per-stage wall time, CPU time, calls, records and peak RSS.
+
+    While disabled, stage() returns one shared null context and wrap() and
+    timed() hand back what they were given, so instrumented code runs as
+    if uninstrumented.  Stages nest; a stage's time includes that of the
+    stages run inside it, e.g. gisaid_json includes gisaid_json.parse.
+    Stages may run on several threads at once (see InputLoader), so a
+    stage's CPU time is that of the thread running it, not of threads or
+    processes it starts.
+    hook_stage, if set, is run under cProfile or tracemalloc (hook).
+    """
+    def __init__(self):
+        self.enabled    = False
+        self.stages     = {}
+        self.hook_stage = None
+        self.hook       = "cprofile"
+        self.hook_out   = sys.stderr
+        self._null      = contextlib.nullcontext()
+        self._lock      = threading.Lock()
+
+    def enable(self, hook_stage=None, hook="cprofile", hook_out=None):
+        self.enabled    = True
+        self.hook_stage = hook_stage
+        self.hook       = hook
+        if hook_out is not None:
+            self.hook_out = hook_out
+
+    def disable(self):
+        """Stop recording and forget the stages recorded so far."""
+        self.__init__()
+
+    def _stats(self, name):
+        with self._lock:
+            try:
+                return self.stages[name]
+            except KeyError:
+                stats = self.stages[name] = {"wall_s": 0.0, "cpu_s": 0.0,
+                                             "calls": 0, "records": 0}
+                return stats
+
+    def _add(self, stats, wall_s=0.0, cpu_s=0.0, calls=0, records=0):
+        with self._lock:
+            stats["wall_s"]  += wall_s
+            stats["cpu_s"]   += cpu_s
+            stats["calls"]   += calls
+            stats["records"] += records
+
+    def stage(self, name, records=None):
+        """Context manager timing the code in its block as stage name."""
+        if not self.enabled:
+            return self._null
+        return self._stage(name, records)
+
+    @contextlib.contextmanager
+    def _stage(self, name, records):
+        stats = self._stats(name)
+        with self._hook(name):
+            wall = time.perf_counter()
+            cpu  = time.thread_time()
+            try:
+                yield stats
+            finally:
+                self._add(stats, time.perf_counter() - wall,
+                          time.thread_time() - cpu, 1, records or 0)
+                stats["max_rss_mb"] = max_rss_mb()
+
+    def count(self, name, records):
+        """Add records to the record count of stage name."""
+        if self.enabled:
+            self._add(self._stats(name), records=records)
+
+    def wrap(self, name, func):
+        """Return func, timed as stage name on each call when enabled.
+
+        For functions called once per record, where a stage() context per
+        call would cost more than the call.
+        """
+        if not self.enabled:
+            return func
+        stats = self._stats(name)
+        clock = time.perf_counter
+        cpu   = time.thread_time
+        add   = self._add
+
+        def timed_func(*args, **kwargs):
+            wall  = clock()
+            start = cpu()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(stats, clock() - wall, cpu() - start, 1)
+        return timed_func
+
+    def timed(self, name, iterable):
+        """Return iterable, with the time spent producing each item and the
+        number of items recorded as stage name when enabled."""
+        if not self.enabled:
+            return iterable
+        return self._timed(self._stats(name), iter(iterable))
+
+    def _timed(self, stats, iterator):
+        clock = time.perf_counter
+        cpu   = time.thread_time
+        self._add(stats, calls=1)
+        while True:
+            wall  = clock()
+            start = cpu()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add(stats, clock() - wall, cpu() - start)
+            self._add(stats, records=1)
+            yield item
+
+    @contextlib.contextmanager
+    def _hook(self, name):
+        if name != self.hook_stage:
+            yield
+        elif self.hook == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"tracemalloc {name}: peak {peak / (1 << 20):.1f} MiB",
+                      file=self.hook_out)
+                for stat in snapshot.statistics("lineno")[:25]:
+                    print(stat, file=self.hook_out)
+        else:
+            import cProfile
+            import pstats
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                print(f"cProfile {name}:", file=self.hook_out)
+                pstats.Stats(profile, stream=self.hook_out) \
+                      .sort_stats("cumulative").print_stats(25)
+
+    def report(self):
+        """Return the stages, in the order first seen, with the peak RSS of
+        the process."""
+        return {"stages": [dict(stage=name, **stats)
+                           for name, stats in self.stages.items()],
+                "max_rss_mb": max_rss_mb()}
+
+    def write(self, path=None):
+        """Write the report as JSON to path, or as a table to stderr."""
+        import json
+        report = self.report()
+        if path is not None:
+            with open(path, "w") as output:
+                json.dump(report, output, indent=2)
+            return
+        print(f"{'stage':<32}{'wall_s':>10}{'cpu_s':>10}{'calls':>10}"
+              f"{'records':>12}{'max_rss_mb':>12}", file=sys.stderr)
+        for stats in report["stages"]:
+            rss = stats.get("max_rss_mb")
+            print(f"{stats['stage']:<32}{stats['wall_s']:>10.3f}"
+                  f"{stats['cpu_s']:>10.3f}{stats['calls']:>10}"
+                  f"{stats['records']:>12}"
+                  f"{'' if rss is None else f'{rss:.1f}':>12}",
+                  file=sys.stderr)
+
+
+PROFILER = Profiler()
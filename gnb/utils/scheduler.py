@@ -0,0 +1,152 @@
+"""
+    This module loads the inputs of a merge concurrently, failing the run
+    as soon as one of them cannot be read.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from concurrent.futures import (FIRST_EXCEPTION, CancelledError, Future,
+                                ThreadPoolExecutor, wait)
+
+
+def process_context():
+    """The multiprocessing context for the GISAID_json worker pools.
+
+    Those pools may be started on an InputLoader thread, and forking a
+    process while other threads run can deadlock the child, so workers
+    are forked from a fork server (or spawned where there is none).
+    """
+    import multiprocessing
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["gnb.utils.table_maker",
+                                    "gnb.utils.decompress"])
+    return context
+
+
+class InputError(Exception):
+    """An input of a merge could not be loaded."""
+    def __init__(self, name, error):
+        super().__init__(f"Could not load {name}: {error!r}")
+        self.name  = name
+        self.error = error
+
+
+class NameFilter():
+    """The virus names a GISAID_json reader keeps, from key(result) of a
+    Future (e.g. the index of the upload sheet being read), or from a
+    collection.
+
+    Until the Future is done every record is kept.  Once cancelled is set,
+    e.g. because another input failed, the reader is stopped by a
+    CancelledError.
+    """
+    def __init__(self, names=None, key=None, cancelled=None):
+        self.future    = names if isinstance(names, Future) else None
+        self.key       = key
+        self.cancelled = cancelled
+        self.value     = None
+        self.names     = None
+        if names is not None and self.future is None:
+            self._set(names)
+        self.extract   = None
+
+    @property
+    def filtering(self):
+        """False for a NameFilter that keeps every record."""
+        return self.future is not None or self.names is not None
+
+    def _set(self, value):
+        self.value = value
+        self.names = frozenset(value)
+
+    def check(self):
+        """Raise CancelledError if the load was cancelled."""
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise CancelledError()
+
+    def get(self):
+        """The names, or None while they are not known."""
+        if self.names is None and self.future is not None and \
+           self.future.done() and not self.future.cancelled() and \
+           self.future.exception() is None:
+            result = self.future.result()
+            self._set(result if self.key is None else self.key(result))
+        return self.names
+
+    def result(self):
+        """The names as given (e.g. an Index), waiting for them if need
+        be."""
+        if self.names is None and self.future is not None:
+            result = self.future.result()
+            self._set(result if self.key is None else self.key(result))
+        return self.value
+
+    def keep_line(self, line):
+        """False if the raw json line is a record of a virus name that is
+        not wanted.  Lines whose name cannot be cut out cheaply are kept."""
+        self.check()
+        names = self.get()
+        if names is None:
+            return True
+        if self.extract is None:
+            from .table_maker import FieldExtractor
+            self.extract = FieldExtractor(["covv_virus_name"])
+        record = self.extract(line)
+        if record is None or "covv_virus_name" not in record:
+            return True
+        return record["covv_virus_name"] in names
+
+    def unfiltered(self):
+        """A NameFilter keeping every record, stopped with this one."""
+        return NameFilter(cancelled=self.cancelled)
+
+
+class InputLoader():
+    """Load the inputs of a merge at once on a pool of threads.
+
+    The spreadsheet parsers and the bz2 decompression of GISAID_json spend
+    much of their time outside the GIL, so the reads overlap.  result()
+    raises InputError on the first input that fails, after cancelling the
+    rest.
+    """
+    def __init__(self, workers=3):
+        self.executor  = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="gnb_load")
+        self.futures   = {}
+        self.cancelled = threading.Event()
+
+    def submit(self, name, func, *args, **kwargs):
+        """Start loading input name with func(*args, **kwargs)."""
+        future = self.executor.submit(func, *args, **kwargs)
+        self.futures[name] = future
+        return future
+
+    def names(self, future, key=None):
+        """A NameFilter on key(result) of future, stopped if the load is
+        cancelled."""
+        return NameFilter(future, key, self.cancelled)
+
+    def result(self):
+        """Wait for every input and return {name: table}."""
+        try:
+            wait(self.futures.values(), return_when=FIRST_EXCEPTION)
+            for name, future in self.futures.items():
+                if future.done() and future.exception() is not None:
+                    raise InputError(name, future.exception())
+            return {name: future.result()
+                    for name, future in self.futures.items()}
+        except BaseException:
+            self.cancelled.set()
+            raise
+        finally:
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for future in self.futures.values():
+                future.cancel()
+            self.executor.shutdown(wait=True)
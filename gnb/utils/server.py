@@ -0,0 +1,269 @@
+"""
+    This module serves BioSample and SRA merges over HTTP, keeping the
+    parsed GISAID download and templates in memory between requests.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Resource():
+    """An input parsed by load(path), parsed again on the first get()
+    after the file changes."""
+    def __init__(self, path, load):
+        self.path    = path
+        self.load    = load
+        self.stamp   = None
+        self.value   = None
+        self.loads   = 0
+        self.lock    = threading.Lock()
+
+    def get(self):
+        stamp = _stamp(self.path)
+        if stamp != self.stamp:
+            with self.lock:
+                if stamp != self.stamp:
+                    self.value = self.load(self.path)
+                    self.stamp = stamp
+                    self.loads += 1
+        return self.value
+
+    def status(self):
+        return {"path": str(self.path), "loads": self.loads,
+                "size": self.stamp and self.stamp[0],
+                "mtime_ns": self.stamp and self.stamp[1]}
+
+
+class MergeService():
+    """The tables behind gnb serve.
+
+    The GISAID download is held as covv_accession_id by virus name, or
+    looked up in an accession index when index is given.  Each merge
+    reads only the upload sheet it is sent.
+    """
+    def __init__(self, ncbi_upload, gisaid_json, sra_template=None,
+                 replacement="missing", index=None, threads=1, **json_args):
+        from .table_maker import Table
+        from .sra_builder import SRA_table
+        self.replacement = replacement
+        self.ncbiup = Resource(ncbi_upload,
+                               lambda path: Table(path).ncbi_template())
+        self.sra = None
+        if sra_template is not None:
+            self.sra = Resource(sra_template, SRA_table().sra_template)
+        self.index = index
+        if index is None:
+            self.gisaidjson = Resource(gisaid_json, lambda path: Table(path)
+                                       .gisaid_json("unknown",
+                                                    threads=threads,
+                                                    columns=["covv_accession_id"],
+                                                    **json_args))
+        else:
+            self.gisaidjson = Resource(gisaid_json, self._index)
+        self.threads = threads
+
+    def _index(self, path):
+        from .accession_index import AccessionIndex
+        with AccessionIndex(self.index) as index:
+            index.update(path, self.threads)
+        return self.index
+
+    def load(self):
+        """Parse every input now rather than on the first request."""
+        for resource in self.resources():
+            resource.get()
+
+    def resources(self):
+        return [resource for resource in (self.ncbiup, self.gisaidjson,
+                                          self.sra) if resource is not None]
+
+    def merge_bsmp(self, gisaid_upload, bioproject, replacement=None):
+        """Return the BioSample TSV for the upload sheet gisaid_upload
+        (bytes)."""
+        from .scheduler import InputError
+        from .table_maker import (Table, merge_biosample_dfs, replace_unknown,
+                                  UPLOAD_COLUMNS)
+        replacement = replacement or self.replacement
+        try:
+            gisaidup = Table(gisaid_upload).gisaid_template(replacement,
+                                                            UPLOAD_COLUMNS)
+        except Exception as error:
+            raise InputError("GISAID_upload", error) from error
+        gisaidjson = self.gisaidjson.get()
+        if self.index is not None:
+            from .accession_index import AccessionIndex
+            with AccessionIndex(gisaidjson) as index:
+                gisaidjson = index.lookup(gisaidup.index)
+        else:
+            gisaidjson = gisaidjson[gisaidjson.index.isin(gisaidup.index)] \
+                         .copy()
+        replace_unknown(gisaidjson, replacement)
+        merged = merge_biosample_dfs(self.ncbiup.get(), gisaidup, gisaidjson,
+                                     bioproject, replacement)
+        return merged.to_csv(sep="\t", index=False)
+
+    def merge_sra(self, gisaid_upload, biosample_attributes):
+        """Return the SRA TSV for the upload sheet and BioSample
+        attributes.tsv (bytes)."""
+        from .scheduler import InputError
+        from .sra_builder import SRA_table, UPLOAD_COLUMNS
+        if self.sra is None:
+            raise ValueError("gnb serve was started without --SRA_template")
+        try:
+            gisaid_up = SRA_table().read_gisaid_metadata(gisaid_upload,
+                                                         UPLOAD_COLUMNS)
+        except Exception as error:
+            raise InputError("GISAID_upload", error) from error
+        try:
+            attributes = SRA_table().bsmpl_attributes(
+                io.BytesIO(biosample_attributes))
+        except Exception as error:
+            raise InputError("BioSample_attributes", error) from error
+        df = SRA_table().sra_builder(gisaid_up, attributes, self.sra.get())
+        return df.to_csv(sep="\t", index_label="biosample_accession")
+
+    def status(self):
+        return {"inputs": [resource.status()
+                           for resource in self.resources()]}
+
+
+def _field(fields, name):
+    try:
+        return fields[name]
+    except KeyError:
+        raise ValueError(f"Missing form field: {name!r}") from None
+
+
+def form_parts(content_type, body):
+    """Return {name: bytes} of a multipart/form-data body."""
+    from email.parser import BytesParser
+    from email.policy import HTTP
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    return {part.get_param("name", header="content-disposition"):
+            part.get_payload(decode=True)
+            for part in message.iter_parts()}
+
+
+class MergeHandler(BaseHTTPRequestHandler):
+    """POST /merge_bsmp?BioProject=...[&replacement=...] with the upload
+    sheet as the body or the GISAID_upload form field.
+
+    POST /merge_sra with form fields GISAID_upload and
+    BioSample_attributes.
+
+    GET /status for the loaded inputs.
+    """
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, code, text, content_type="text/tab-separated-values"):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/status":
+            self._send(200, json.dumps(self.server.service.status()),
+                       "application/json")
+        else:
+            self._send(404, f"Not found: {self.path}\n", "text/plain")
+
+    def do_POST(self):
+        from .scheduler import InputError
+        url    = urlsplit(self.path)
+        query  = {key: values[-1]
+                  for key, values in parse_qs(url.query).items()}
+        body   = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        ctype  = self.headers.get("Content-Type", "")
+        fields = form_parts(ctype, body) \
+                 if ctype.startswith("multipart/form-data") else \
+                 {"GISAID_upload": body}
+        service = self.server.service
+        try:
+            if url.path == "/merge_bsmp":
+                if "BioProject" not in query:
+                    raise ValueError("Missing query parameter: BioProject")
+                text = service.merge_bsmp(_field(fields, "GISAID_upload"),
+                                          query["BioProject"],
+                                          query.get("replacement"))
+            elif url.path == "/merge_sra":
+                text = service.merge_sra(_field(fields, "GISAID_upload"),
+                                         _field(fields,
+                                                "BioSample_attributes"))
+            else:
+                self._send(404, f"Not found: {self.path}\n", "text/plain")
+                return
+        except (InputError, ValueError) as error:
+            self._send(400, f"{error}\n", "text/plain")
+        except Exception:
+            # a fault of the server or its inputs, not of the request
+            print(f"{self.command} {self.path} failed:", file=sys.stderr)
+            traceback.print_exc()
+            self._send(500, "Internal server error\n", "text/plain")
+        else:
+            self._send(200, text)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host="127.0.0.1", port=8000, socket_path=None,
+                verbose=False):
+    """Return a threading HTTP server for service on host:port, or on the
+    Unix socket socket_path."""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, MergeHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), MergeHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def serve(service, host="127.0.0.1", port=8000, socket_path=None,
+          verbose=False):
+    """Load the inputs, then serve until interrupted."""
+    service.load()
+    server = make_server(service, host, port, socket_path, verbose)
+    where = socket_path or "http://{}:{}".format(*server.server_address[:2])
+    print(f"gnb serving on {where}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,142 @@
+"""
+    This module runs the GISAID side of a merge out of core, spilling the
+    parsed records to partitions on disk.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import pickle
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# generous size of one parsed GISAID record, used to size the chunks
+ROW_BYTES = 2048
+PARTITIONS = 16
+
+
+def parse_size(text):
+    """Return the number of bytes in text, e.g. '512M', '2G' or '1000'."""
+    found = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*",
+                         str(text), re.IGNORECASE)
+    if found is None:
+        raise ValueError(f"Not a memory size: {text}")
+    return int(float(found.group(1)) * UNITS[found.group(2).upper()])
+
+
+def partition_of(keys, partitions):
+    """The partition of each key (an Index or array of virus names)."""
+    import numpy as np
+    import pandas as pd
+    hashes = pd.util.hash_array(np.asarray(keys, dtype=object))
+    return (hashes % partitions).astype(np.int64)
+
+
+class PartitionedSpill():
+    """DataFrame chunks hashed by index into partition files on disk.
+
+    Each write() appends one pickled chunk per partition, so the rows of
+    a key keep their order and a partition is read back a chunk at a
+    time.  The files go in a directory of their own, made in directory
+    (or the system temporary directory) so that runs sharing a spill
+    directory do not collide, and removed on close().
+    """
+    def __init__(self, directory=None, partitions=PARTITIONS):
+        self.partitions = partitions
+        if directory is not None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        self.directory  = Path(tempfile.mkdtemp(prefix="gnb_spill_",
+                                                dir=directory))
+        self.rows       = [0] * partitions
+        for partition in range(partitions):
+            self._path(partition).write_bytes(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _path(self, partition):
+        return self.directory / f"part-{partition:04d}.pkl"
+
+    def write(self, df):
+        """Append the rows of df to their partitions."""
+        parts = partition_of(df.index, self.partitions)
+        for partition in range(self.partitions):
+            rows = df[parts == partition]
+            if len(rows):
+                with open(self._path(partition), "ab") as spill:
+                    pickle.dump(rows, spill, protocol=pickle.HIGHEST_PROTOCOL)
+                self.rows[partition] += len(rows)
+
+    def read(self, partition):
+        """Yield the chunks of partition in the order written."""
+        with open(self._path(partition), "rb") as spill:
+            while True:
+                try:
+                    yield pickle.load(spill)
+                except EOFError:
+                    return
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def semi_join(spill, names):
+    """Return the spilled rows whose index is in names, read one
+    partition chunk at a time."""
+    import pandas as pd
+    names = pd.Index(names).unique()
+    wanted = partition_of(names, spill.partitions)
+    matched = []
+    for partition in range(spill.partitions):
+        keys = names[wanted == partition]
+        if not len(keys) or not spill.rows[partition]:
+            continue
+        for chunk in spill.read(partition):
+            hits = chunk[chunk.index.isin(keys)]
+            if len(hits):
+                matched.append(hits)
+    if not matched:
+        return None
+    return pd.concat(matched)
+
+
+def gisaid_out_of_core(table, names, unknown, max_memory, spill_dir=None,
+                       partitions=PARTITIONS, **json_args):
+    """The rows of the GISAID download table (a Table) indexed by a name
+    in names, as gisaid_json would give them, holding at most about
+    max_memory bytes of parsed records at once.
+
+    The download is parsed in chunks of max_memory / 4 bytes, which are
+    spilled to partitions hashed by covv_virus_name; each partition is
+    then streamed past the names that hash to it.  names may be a
+    NameFilter, which also skips the records of other names while the
+    download streams and is waited for before the semi join.
+    """
+    import pandas as pd
+    from .scheduler import NameFilter
+    chunksize = max(1, max_memory // 4 // ROW_BYTES)
+    if isinstance(names, NameFilter):
+        json_args["names"] = names
+    with PartitionedSpill(spill_dir, partitions) as spill:
+        columns = None
+        for chunk in table.gisaid_json_chunks(unknown, chunksize=chunksize,
+                                              **json_args):
+            if columns is None:
+                columns = chunk.columns
+            spill.write(chunk)
+        if isinstance(names, NameFilter):
+            names = names.result()
+        matched = semi_join(spill, names)
+    if matched is None:
+        return pd.DataFrame(columns=columns if columns is not None
+                            else ["covv_virus_name", "covv_accession_id"])
+    return matched
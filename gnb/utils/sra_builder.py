@@ -12,17 +12,62 @@ MACHINES = {"Illumina NextSeq 550": "NextSeq 550",
             "Illumina iSeq": "Illumina iSeq 100",
             "Illumina NextSeq 500": "NextSeq 500",
             "nan": "missing"}
+UPLOAD_COLUMNS = ["Virus name", "Sequencing technology", "Assembly method"]
 METHODS = "Using minimap2, short reads mapped to SARS-CoV-2 NCBI accession MN908947.3. Using samtools, proper_pairs (samflag 2) mapping to MN908947.3 retained, unmapped reads (samflag 4) discarded (to filter out non-SARS-CoV-2 cDNA). Filtered reads submitted to NCBI"
 
 # print(MACHINES["Illumina NextSeq 550"])
+import numpy as np
 import pandas as pd
+from .loader import read_table, read_template
+from .profiler import PROFILER
+from .table_maker import as_text
+
+
+def instrument_models(technologies):
+    """Map GISAID 'Sequencing technology' values to SRA instrument_model.
+
+    Raises ValueError naming every technology missing from MACHINES.
+    """
+    technologies = as_text(technologies)
+    models = technologies.map(MACHINES)
+    unmapped = technologies[models.isnull()].unique()
+    if len(unmapped):
+        raise ValueError("No SRA instrument_model in MACHINES for "
+                         "sequencing technology: " +
+                         ", ".join(sorted(unmapped)))
+    return models
+
+def join_keys(left, right):
+    """Hash join the keys of left onto the keys of right (both pandas
+    Index), returning the positions of the matched rows in each, in the
+    order of left, and a report of the keys unmatched on each side.
+
+    Raises ValueError naming any key that is repeated on either side.
+    """
+    for side, keys in (("GISAID upload", left),
+                       ("BioSample attributes", right)):
+        repeated = keys[keys.duplicated() & keys.notnull()].unique()
+        if len(repeated):
+            raise ValueError(f"Repeated virus name in {side}: " +
+                             ", ".join(map(str, repeated)))
+    right_pos = right.get_indexer(left)
+    right_pos[left.isnull()] = -1
+    matched = right_pos >= 0
+    left_pos = np.flatnonzero(matched)
+    right_pos = right_pos[matched]
+    right_hit = np.zeros(len(right), dtype=bool)
+    right_hit[right_pos] = True
+    unmatched = {"GISAID_upload": list(left[~matched]),
+                 "BioSample_attributes": list(right[~right_hit])}
+    return left_pos, right_pos, unmatched
+
 
 class SRA_table:
     # def __init__(self, intable):
     #     self.intable = intable
 
     def sra_template(self, intable):
-        df = pd.read_excel(intable, header=0, sheet_name=1)
+        df = read_template(intable, sheet_name=1)
         return df
  
         # self.sra_template = sra_template
@@ -35,45 +80,55 @@ class SRA_table:
         return df
     
 
-    def read_gisaid_metadata(self, intable):
-        df = None
-        try:
-            df = pd.read_excel(intable, header=1, sheet_name=1, index_col=2) # if .xls was used for GISAID upload
-        except:
-            df = pd.read_csv(intable, header=1, sep=",") # if csv format was used for GISAID upload
-            df.set_index('Virus name', inplace=True)
-        # print(df)
-        # df = pd.read_excel(intable, header=1, sheet_name=1, index_col=2)
+    def read_gisaid_metadata(self, intable, usecols=None):
+        """Read the GISAID upload sheet (excel or csv) with its human
+        readable headers.  Pass usecols=UPLOAD_COLUMNS to read only what
+        sra_builder uses.
+        """
+        df = read_table(intable, sheet_name=1, header=1, usecols=usecols)
+        df.set_index('Virus name', inplace=True)
 #         df = df.drop(df.index[0])
         return df
 
     def sra_builder(self, gisaid_up,
                     biosample_attributes,
                     sra_table):
-        df = pd.concat([gisaid_up, biosample_attributes], axis=1)
-        df.set_index("accession", inplace=True)
-        # print(df.to_csv(sep="\t"))
-        # below will make the sra_table and df have the same index.values
-        sra_table['biosample_accession'] = pd.Series(df.index.values).apply(lambda x: f"{x}")
-        sra_table.set_index("biosample_accession", inplace=True)
-        sra_table2 = pd.concat([sra_table, df], axis=1)
-        # print(sra_table2.index.values)
-        sra_table2['library_ID'] = sra_table2[['isolate']].apply(lambda x: f"{x.values[0]}_illumina", axis=1)
-        sra_table2['title'] = "Severe acute respiratory syndrome coronavirus 2"
-        sra_table2['library_strategy'] = "AMPLICON"
-        sra_table2['library_source'] = "VIRAL RNA"
-        sra_table2['library_selection'] = "PCR"
-        sra_table2['library_layout'] = "paired"
-        sra_table2['platform'] = "ILLUMINA"
-        # print(sra_table2.columns)
-        # print(sra_table2[['Sequencing technology']])
-        # print(sra_table2.dtypes)
-        sra_table2["instrument_model"] = sra_table2[['Sequencing technology']].apply(lambda x: f"{MACHINES[str(x.values[0])]}", axis=1)
-        sra_table2['design_description'] = sra_table2[["Assembly method"]].apply(lambda x: f"{x.values[0]}. {METHODS}", axis=1)
-        sra_table2["filetype"] = "fastq"
-        sra_table2["filename"] = sra_table2[["isolate"]].apply(lambda x: f"{x.values[0]}_R1.fq.gz", axis=1)
-        sra_table2["filename2"] =  sra_table2[["isolate"]].apply(lambda x: f"{x.values[0]}_R2.fq.gz", axis=1)
-        # print(sra_table2["instrument_model"])
-        # sra_table['library_ID'] = df[]
-        return sra_table2[sra_table.columns]
+        """Build the SRA table from the GISAID upload rows whose virus name
+        is a sample_name in the BioSample attributes, indexed by the
+        BioSample accession.  The keys left unmatched on each side are
+        kept in self.unmatched.
+        """
+        with PROFILER.stage("sra_builder", gisaid_up.shape[0]):
+            return self._sra_builder(gisaid_up, biosample_attributes,
+                                     sra_table)
+
+    def _sra_builder(self, gisaid_up, biosample_attributes, sra_table):
+        # virus name in the GISAID upload -> sample_name -> accession
+        left, right, self.unmatched = join_keys(gisaid_up.index,
+                                                biosample_attributes.index)
+        accession = pd.Index(as_text(biosample_attributes['accession'])
+                             .to_numpy()[right], name='biosample_accession')
+
+        def column(df, name, rows):
+            return pd.Series(df[name].to_numpy()[rows], index=accession)
+        isolate = as_text(column(biosample_attributes, 'isolate', right))
+        sra = {}
+        sra['library_ID'] = isolate + "_illumina"
+        sra['title'] = "Severe acute respiratory syndrome coronavirus 2"
+        sra['library_strategy'] = "AMPLICON"
+        sra['library_source'] = "VIRAL RNA"
+        sra['library_selection'] = "PCR"
+        sra['library_layout'] = "paired"
+        sra['platform'] = "ILLUMINA"
+        sra["instrument_model"] = instrument_models(
+            column(gisaid_up, 'Sequencing technology', left))
+        sra['design_description'] = as_text(
+            column(gisaid_up, "Assembly method", left)) + f". {METHODS}"
+        sra["filetype"] = "fastq"
+        sra["filename"] = isolate + "_R1.fq.gz"
+        sra["filename2"] = isolate + "_R2.fq.gz"
+        columns = [col for col in sra_table.columns
+                   if col != 'biosample_accession']
+        return pd.DataFrame({col: sra.get(col, np.nan) for col in columns},
+                            index=accession, columns=columns)
     
\ No newline at end of file
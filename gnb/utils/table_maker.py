@@ -10,58 +10,625 @@
     <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
 import pandas as pd
+from .loader import read_table, read_template
+from .profiler import PROFILER
+
+
+UPLOAD_COLUMNS = ["covv_virus_name", "covv_orig_lab", "covv_collection_date",
+                  "covv_location", "covv_patient_age", "covv_gender",
+                  "covv_passage"]
+# bytes of raw json lines handed to a parse worker at a time
+PARSE_BATCH = 4 << 20
+# GISAID json fields holding a small set of values repeated across records
+CATEGORICAL_COLUMNS = ["covv_location", "covv_orig_lab", "covv_subm_lab",
+                       "covv_host", "covv_gender", "covv_seq_technology",
+                       "covv_passage", "covv_specimen", "covv_type",
+                       "covv_lineage", "covv_clade", "covv_add_host_info",
+                       "covv_patient_status", "covv_assembly_method"]
 
 
 class Table():
     def __init__(self, indata):
         self.indata = indata
 
-    def gisaid_template(self, unknown):
-        df = None
-        try:
-            df = pd.read_excel(self.indata, header=0, sheet_name=1)
-        except:
-            df = pd.read_csv(self.indata, header=0, sep=",")
+    def gisaid_template(self, unknown, usecols=None):
+        """Read the GISAID upload sheet (excel or csv).  Pass
+        usecols=UPLOAD_COLUMNS to read only what merge_biosample_dfs uses.
+        """
+        df = read_table(self.indata, sheet_name=1, header=0, usecols=usecols)
         df.set_index("covv_virus_name", inplace=True)
         df = df.drop(df.index[0]) #drops the first row (=duplicated header)
         df.replace("unknown", unknown, inplace=True)
         return df
 
     def ncbi_template(self):
-        df = pd.read_excel(self.indata, skiprows=12)
+        df = read_template(self.indata, skiprows=12)
         return df
 
-    def gisaid_json(self, unknown, todrop=None, bzgrep_regex=None):
-        import json
-        import bz2
-        import os
-        import shlex
+    def gisaid_json(self, unknown, todrop=None, bzgrep_regex=None,
+                    prefilter=False, match_fields=None, threads=1, cache=None,
+                    refresh_cache=False, columns=None, workers=1,
+                    names=None):
+        """Read the GISAID metadata.json download into one table.  It may
+        be bz2, gzip, xz or zstd compressed, or a tar archive of it.
+
+        Matching records are collected column-wise and the DataFrame is
+        built once at the end.  With prefilter, bzgrep_regex is first tried
+        on each raw line so that only the lines that hit are parsed.  With
+        match_fields, bzgrep_regex is only matched against those keys.
+        With columns, only those keys are kept; when the record is not
+        needed whole for bzgrep_regex, they are cut straight out of the raw
+        line and the rest of it is never parsed.
+        With threads > 1, decompression is spread over that many cores.
+        With workers > 1, batches of lines are parsed and filtered by that
+        many processes.
+        With a GisaidCache, the table is loaded from the cache when the
+        same file has been read with the same arguments before, unless
+        refresh_cache is set.
+        With names (virus names, or a NameFilter whose names may arrive
+        while the download streams), only the records of those names are
+        returned.  Records of other names are skipped before parsing once
+        the names are known, unless a cache is given, in which case the
+        whole table is cached for the next run.
+        """
+        with PROFILER.stage("gisaid_json"):
+            dfs = self._gisaid_json(unknown, todrop, bzgrep_regex, prefilter,
+                                    match_fields, threads, cache,
+                                    refresh_cache, columns, workers, names)
+        PROFILER.count("gisaid_json", dfs.shape[0])
+        return dfs
+
+    def _gisaid_json(self, unknown, todrop, bzgrep_regex, prefilter,
+                     match_fields, threads, cache, refresh_cache, columns,
+                     workers=1, names=None):
+        if isinstance(todrop, str):
+            todrop = [todrop]
+        names = _name_filter(names)
+        if names is not None and names.filtering and cache is not None:
+            dfs = self._gisaid_json(unknown, todrop, bzgrep_regex, prefilter,
+                                    match_fields, threads, cache,
+                                    refresh_cache, columns, workers,
+                                    names.unfiltered())
+            return dfs[dfs.index.isin(names.result())]
+        if cache is not None:
+            try:
+                key = cache.key(self.indata, unknown=unknown,
+                                todrop=list(todrop) if todrop else None,
+                                bzgrep_regex=bzgrep_regex,
+                                prefilter=prefilter,
+                                match_fields=match_fields,
+                                columns=list(columns) if columns else None)
+                if not refresh_cache:
+                    with PROFILER.stage("gisaid_json.cache_load"):
+                        dfs = cache.load(key)
+                    if dfs is not None:
+                        return dfs
+            except OSError as error:
+                cache = _without_cache(error)
+        records = ColumnBuffer(CATEGORICAL_COLUMNS)
+        if workers > 1:
+            for buffer in self._gisaid_buffers(todrop, bzgrep_regex,
+                                               prefilter, match_fields,
+                                               threads, columns, workers,
+                                               names):
+                records.extend(buffer)
+        else:
+            for df_dict in self._gisaid_records(todrop, bzgrep_regex,
+                                                prefilter, match_fields,
+                                                threads, columns, names):
+                records.append(df_dict["covv_virus_name"], df_dict)
+        with PROFILER.stage("gisaid_json.to_frame", len(records)):
+            dfs = records.to_frame()
+            replace_unknown(dfs, unknown)
+        if names is not None and names.filtering:
+            # records read before the names were known
+            return dfs[dfs.index.isin(names.result())]
+        if cache is not None:
+            with PROFILER.stage("gisaid_json.cache_store"):
+                try:
+                    cache.store(key, dfs)
+                except OSError as error:
+                    _without_cache(error)
+        return dfs
+
+    def gisaid_json_chunks(self, unknown, todrop=None, bzgrep_regex=None,
+                           prefilter=False, match_fields=None, threads=1,
+                           chunksize=100000, columns=None, names=None):
+        """Yield the GISAID metadata.json.bz2 download as DataFrames of at
+        most chunksize rows.  With names, as gisaid_json, except that the
+        chunks may hold records read before the names were known.
+        """
+        if isinstance(todrop, str):
+            todrop = [todrop]
+        records = ColumnBuffer(CATEGORICAL_COLUMNS)
+        for df_dict in self._gisaid_records(todrop, bzgrep_regex, prefilter,
+                                            match_fields, threads, columns,
+                                            _name_filter(names)):
+            records.append(df_dict["covv_virus_name"], df_dict)
+            if len(records) >= chunksize:
+                dfs = records.to_frame()
+                replace_unknown(dfs, unknown)
+                yield dfs
+                records = ColumnBuffer(CATEGORICAL_COLUMNS)
+        if len(records) or records.columns:
+            dfs = records.to_frame()
+            replace_unknown(dfs, unknown)
+            yield dfs
+
+    def _gisaid_records(self, todrop=None, bzgrep_regex=None, prefilter=False,
+                        match_fields=None, threads=1, columns=None,
+                        names=None):
+        from .codec import input_lines
+        parse = RecordParser(todrop, bzgrep_regex, prefilter, match_fields,
+                             columns, names)
+        lines = PROFILER.timed("gisaid_json.decompress",
+                               input_lines(self.indata, threads))
+        for line in lines:
+            df_dict = parse(line)
+            if df_dict is not None:
+                yield df_dict
+
+    def _gisaid_buffers(self, todrop=None, bzgrep_regex=None, prefilter=False,
+                        match_fields=None, threads=1, columns=None,
+                        workers=2, names=None):
+        """Yield a ColumnBuffer of the matching records of each batch of
+        about PARSE_BATCH bytes of lines, parsed by a pool of worker
+        processes, in file order.  The names known when a batch is sent
+        go with it.
+
+        A seekable zstd download is not decompressed here: each worker is
+        handed a range of its frames to decompress as well as parse.
+        """
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        from .codec import SeekableZstd, detect, input_lines
+        from .scheduler import process_context
+        options = (todrop, bzgrep_regex, prefilter, match_fields, columns)
+        seekable = SeekableZstd.open(self.indata) \
+                   if detect(self.indata) == "zstd" else None
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=process_context(),
+                                 initializer=_init_parser,
+                                 initargs=(options,)) as executor:
+            if seekable is not None:
+                yield from self._frame_buffers(seekable, executor, workers,
+                                               names)
+                return
+            lines = PROFILER.timed("gisaid_json.decompress",
+                                   input_lines(self.indata, threads))
+            pending = deque()
+            batch = []
+            size = 0
+            for line in lines:
+                batch.append(line)
+                size += len(line)
+                if size >= PARSE_BATCH:
+                    if names is not None:
+                        names.check()
+                    pending.append(executor.submit(_parse_batch, batch,
+                                                   _names_of(names)))
+                    batch = []
+                    size = 0
+                    if len(pending) > 2 * workers:
+                        yield pending.popleft().result()
+            if batch:
+                pending.append(executor.submit(_parse_batch, batch,
+                                               _names_of(names)))
+            while pending:
+                yield pending.popleft().result()
+
+    def _frame_buffers(self, seekable, executor, workers, names=None):
+        from collections import deque
+        pending = deque()
+        for first, stop in seekable.batches(PARSE_BATCH):
+            if names is not None:
+                names.check()
+            pending.append(executor.submit(_parse_frames, seekable.path,
+                                           first, stop, _names_of(names)))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class RecordParser():
+    """Parse, filter and project one raw GISAID json line, returning the
+    record as a dict, or None if it does not match.
+
+    json is parsed with orjson when it is installed, falling back to the
+    json module for what orjson rejects (e.g. NaN, integers over 64 bits).
+    With names (a NameFilter), lines of other virus names are skipped
+    unparsed.
+    """
+    def __init__(self, todrop=None, bzgrep_regex=None, prefilter=False,
+                 match_fields=None, columns=None, names=None):
         import re
-        import sys
-        from subprocess import Popen, PIPE
+        self.names = names
+        self.todrop = todrop
+        self.match_fields = match_fields
+        self.raw_filter = None
+        self.search = None
+        self.keep = None
+        self.extract = None
+        if columns is not None:
+            self.keep = list(dict.fromkeys(["covv_virus_name", *columns]))
+            if match_fields or not bzgrep_regex:
+                self.extract = PROFILER.wrap("gisaid_json.extract",
+                                             FieldExtractor(self.keep + [
+                                                 field for field in
+                                                 match_fields or []
+                                                 if field not in self.keep]))
         if bzgrep_regex:
-            bzgrep_regex = re.compile(rf"{bzgrep_regex}")
-        # else:
-        #     bzgrep_regex = re.compile(rf"")
-        dfs = []
-        with bz2.BZ2File(self.indata, "r") as file:
-            for index, line in enumerate(file):
-                df_dict = json.loads(line)
-                if todrop:
-                    for drop in todrop:
-                        df_dict.pop(drop, None)
+            if prefilter and RawLineFilter.exact(bzgrep_regex, match_fields):
+                self.raw_filter = PROFILER.wrap("gisaid_json.prefilter",
+                                                RawLineFilter(bzgrep_regex,
+                                                              match_fields))
+            self.search = PROFILER.wrap("gisaid_json.regex",
+                                        re.compile(rf"{bzgrep_regex}").search)
+        self.loads = PROFILER.wrap("gisaid_json.parse", json_loads())
+
+    def __call__(self, line):
+        if self.raw_filter and not self.raw_filter(line):
+            return None
+        if self.names is not None and not self.names.keep_line(line):
+            return None
+        df_dict = self.extract(line) if self.extract else None
+        if df_dict is None:
+            df_dict = self.loads(line)
+        return self.record(df_dict)
+
+    def record(self, df_dict):
+        """Drop, filter and project a parsed record (changed in place)."""
+        import re
+        if self.todrop:
+            for drop in self.todrop:
+                df_dict.pop(drop, None)
+        if self.search and self.match_fields:
+            values = [str(df_dict[field]) for field in self.match_fields
+                      if field in df_dict]
+            if not self.search(' '.join(values)):
+                return None
+        elif self.search and not self.search(' '.join(list(map(str, df_dict.values()))), re.IGNORECASE):
+            return None
+        if self.keep is not None:
+            df_dict = {field: df_dict[field] for field in self.keep
+                       if field in df_dict}
+        return df_dict
+
+
+def json_loads():
+    """orjson.loads, falling back to json.loads, or json.loads if orjson
+    is not installed."""
+    import json
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+
+    def loads(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return json.loads(line)
+    return loads
+
+
+_PARSER = {}
+
+
+def _init_parser(options):
+    _PARSER["parse"] = RecordParser(*options)
+
+
+def _parse_batch(lines, names=None):
+    parse = _PARSER["parse"]
+    parse.names = _name_filter(names)
+    records = ColumnBuffer(CATEGORICAL_COLUMNS)
+    for line in lines:
+        df_dict = parse(line)
+        if df_dict is not None:
+            records.append(df_dict["covv_virus_name"], df_dict)
+    return records
+
+
+def _parse_frames(path, first, stop, names=None):
+    from .codec import SeekableZstd
+    if _PARSER.get("path") != path:
+        _PARSER["seekable"] = SeekableZstd(path)
+        _PARSER["path"] = path
+    return _parse_batch(_PARSER["seekable"].lines(first, stop), names)
+
+
+def _without_cache(error):
+    """Carry on without the GISAID_json cache, e.g. when its directory is
+    read-only."""
+    import sys
+    print(f"GISAID_json cache not used: {error}", file=sys.stderr)
+    return None
+
+
+def _name_filter(names):
+    """names as a NameFilter, or None."""
+    from .scheduler import NameFilter
+    if names is None or isinstance(names, NameFilter):
+        return names
+    return NameFilter(names)
+
+
+def _names_of(names):
+    """The names known so far of a NameFilter, to send to a worker."""
+    return None if names is None else names.get()
+
+
+class RawLineFilter():
+    """Test an undecoded GISAID json line against a regex before parsing.
+
+    A line that fails this test cannot pass the post-parse filter, so only
+    the lines that hit need json.loads.  The test is against the whole raw
+    line, or, with fields, against just the raw values of those keys.
+    Lines containing json escapes are always let through, as their raw text
+    differs from the decoded values, as are lines whose field values are
+    lists or objects.
+
+    The post-parse filter searches the Python text of the values joined by
+    spaces (None where the line has null, and so on), so the whole line
+    can only stand in for it when exact() says so.
+    """
+    # text of a parsed value that is not in the raw line it came from
+    PYTHON_ONLY = ("None", "True", "False", "nan", "inf")
+    LITERAL     = r"(?:[^\\.^$*+?{}\[\]()|]|\\[^\w\s])+"
+
+    @classmethod
+    def exact(cls, pattern, fields=None):
+        """True if testing the raw line against pattern never drops a line
+        the post-parse filter keeps: always with fields, otherwise only
+        for alternations of literals, such as the default
+        'Australia|Timor\\-Leste|Oceania', that cannot match across the
+        space between two values or inside Python text like None."""
+        import re
+        if fields:
+            return True
+        for alternative in pattern.split("|"):
+            if not re.fullmatch(cls.LITERAL, alternative):
+                return False
+            literal = re.sub(r"\\(.)", r"\1", alternative)
+            if re.search(r"""[\s'"\[\]{}:,]""", literal) or \
+               re.fullmatch(r"[\d.eE+-]+", literal) or \
+               any(literal in text for text in cls.PYTHON_ONLY):
+                return False
+        return True
+
+    def __init__(self, pattern, fields=None):
+        import re
+        self.regex = re.compile(pattern)
+        self.bytes_regex = None
+        if pattern.isascii():
+            self.bytes_regex = re.compile(pattern.encode())
+        self.fields = None
+        if fields:
+            self.fields = [_field_regex(field) for field in fields]
+
+    def __call__(self, line):
+        import json
+        if b"\\" in line:
+            return True
+        if self.fields is None:
+            if self.bytes_regex is not None and line.isascii():
+                return self.bytes_regex.search(line) is not None
+            return self.regex.search(line.decode("utf-8")) is not None
+        values = []
+        for field in self.fields:
+            found = field.search(line)
+            if found:
+                try:
+                    values.append(str(json.loads(found.group(1))))
+                except ValueError:
+                    # a list or object, only cut up to its first comma
+                    return True
+        return self.regex.search(' '.join(values)) is not None
+
+
+class FieldExtractor():
+    """Cut the values of fields out of an undecoded GISAID json line.
+
+    Returns a dict of the fields present in the line, in the order of
+    fields, or None when the line has to be parsed whole: it contains json
+    escapes, or a field's value is not a plain string or scalar.
+    """
+    def __init__(self, fields):
+        self.fields = [(field, field.encode(), _field_regex(field))
+                       for field in fields]
+
+    def __call__(self, line):
+        import json
+        if b"\\" in line:
+            return None
+        record = {}
+        for field, name, regex in self.fields:
+            found = regex.search(line)
+            if found is None:
+                if b'"' + name + b'"' in line:
+                    return None
+                continue
+            value = found.group(1)
+            if value[:1] == b'"':
+                record[field] = value[1:-1].decode("utf-8")
+            elif value[:1] in (b"[", b"{"):
+                return None
+            else:
+                try:
+                    record[field] = json.loads(value)
+                except ValueError:
+                    return None
+        return record
+
+
+def _field_regex(field):
+    import re
+    return re.compile(rb'"' + re.escape(field.encode()) +
+                      rb'"\s*:\s*("[^"\\]*"|[^,}\s]+)')
+
+
+class ColumnBuffer():
+    """Accumulate flat records column by column.
+
+    Keys first seen part way through are back-filled with NaN, as are keys
+    missing from a record, matching the result of concatenating one-row
+    DataFrames.  Keys in categorical are stored as CategoryColumns and
+    become pandas categoricals.
+    """
+    def __init__(self, categorical=()):
+        self.index = []
+        self.columns = {}
+        self.categorical = set(categorical)
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, key, record):
+        nrows = len(self.index)
+        columns = self.columns
+        for col, value in record.items():
+            try:
+                values = columns[col]
+            except KeyError:
+                if col not in self.categorical:
+                    columns[col] = [float("nan")] * nrows + [value]
+                    continue
+                values = columns[col] = CategoryColumn(nrows)
+            try:
+                values.append(value)
+            except TypeError:
+                # an unhashable value (list, dict) in a categorical column
+                columns[col] = values.tolist() + [value]
+        self.index.append(key)
+        if len(record) < len(columns):
+            for values in columns.values():
+                if len(values) == nrows:
+                    values.append(float("nan"))
+
+    def extend(self, other):
+        """Append the rows of another ColumnBuffer."""
+        nrows = len(self.index)
+        for col, values in other.columns.items():
+            if col not in self.columns:
+                self.columns[col] = CategoryColumn(nrows) \
+                                    if isinstance(values, CategoryColumn) \
+                                    else [float("nan")] * nrows
+            mine = self.columns[col]
+            if isinstance(mine, CategoryColumn) != \
+               isinstance(values, CategoryColumn):
+                # one side fell back to a plain column, so both do
+                if isinstance(mine, CategoryColumn):
+                    mine = self.columns[col] = mine.tolist()
                 else:
-                    pass
-                if bzgrep_regex and bzgrep_regex.search(' '.join(list(map(str, df_dict.values()))), re.IGNORECASE):
-                    dfs.append(pd.DataFrame(df_dict, index=[df_dict["covv_virus_name"]]))
-                elif bzgrep_regex is None:
-                    dfs.append(pd.DataFrame(df_dict, index=[df_dict["covv_virus_name"]]))
+                    values = values.tolist()
+            mine.extend(values)
+        self.index.extend(other.index)
+        nrows = len(self.index)
+        for col, values in self.columns.items():
+            if len(values) < nrows:
+                if isinstance(values, CategoryColumn):
+                    values.extend(CategoryColumn(nrows - len(values)))
                 else:
-                    pass
-        dfs = pd.concat(dfs)
-        dfs.replace("unknown", unknown, inplace=True)
-        return dfs
+                    values.extend([float("nan")] * (nrows - len(values)))
+
+    def to_frame(self):
+        columns = {col: values.to_categorical()
+                   if isinstance(values, CategoryColumn) else values
+                   for col, values in self.columns.items()}
+        return pd.DataFrame(columns, index=self.index)
+
+
+class CategoryColumn():
+    """A column of repeated values kept as int32 codes into a list of
+    distinct values, so each row costs four bytes however long its text.
+    None and NaN are stored as the missing code, -1.
+
+    Values are told apart by type as well as value, so True, 1 and 1.0
+    stay distinct.  append() raises TypeError for an unhashable value;
+    the caller then keeps the column as tolist().
+    """
+    def __init__(self, nmissing=0):
+        from array import array
+        self.codes = array("i", [-1]) * nmissing
+        self.lookup = {}
+        self.categories = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        key = (value.__class__, value)
+        try:
+            code = self.lookup[key]
+        except KeyError:
+            if value is None or value != value:
+                code = -1
+            else:
+                code = self.lookup[key] = len(self.categories)
+                self.categories.append(value)
+        self.codes.append(code)
+
+    def extend(self, other):
+        """Append the rows of another CategoryColumn."""
+        remap = []
+        for value in other.categories:
+            key  = (value.__class__, value)
+            code = self.lookup.get(key)
+            if code is None:
+                code = self.lookup[key] = len(self.categories)
+                self.categories.append(value)
+            remap.append(code)
+        remap = np.array(remap + [-1], dtype=np.int32)
+        self.codes.frombytes(remap[np.frombuffer(other.codes, dtype=np.int32)]
+                             .tobytes())
+
+    def tolist(self):
+        """The values of the column, NaN where missing."""
+        values = self.categories + [float("nan")]
+        return [values[code] for code in self.codes]
+
+    def to_categorical(self):
+        """The column as a pandas Categorical, or as a list if pandas
+        would take two of its categories, e.g. True and 1, as one."""
+        categories = pd.Index(self.categories)
+        if not categories.is_unique:
+            return self.tolist()
+        return pd.Categorical.from_codes(np.frombuffer(self.codes,
+                                                       dtype=np.int32),
+                                         categories)
+
+
+def replace_unknown(df, unknown):
+    """df.replace("unknown", unknown, inplace=True), renaming the category
+    of categorical columns rather than visiting every cell."""
+    if unknown == "unknown":
+        return
+    plain = []
+    for col in df.columns:
+        values = df[col]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            plain.append(col)
+            continue
+        categories = list(values.cat.categories)
+        if "unknown" not in categories:
+            continue
+        renamed = list(dict.fromkeys(unknown if category == "unknown"
+                                     else category
+                                     for category in categories))
+        position = {category: code for code, category in enumerate(renamed)}
+        remap = np.array([position[unknown if category == "unknown"
+                                   else category]
+                          for category in categories] + [-1], dtype=np.int32)
+        df[col] = pd.Categorical.from_codes(remap[values.cat.codes.values],
+                                            pd.Index(renamed))
+    if len(plain) == len(df.columns):
+        df.replace("unknown", unknown, inplace=True)
+    elif plain:
+        df[plain] = df[plain].replace("unknown", unknown)
 
 
 def merge_biosample_dfs(ncbiup, gisaidup, gisaidjson, bioproject, unknown,
@@ -80,27 +647,60 @@ def merge_biosample_dfs(ncbiup, gisaidup, gisaidjson, bioproject, unknown,
     Returns:
         pd.DataFrame -- stdout as TSV for NCBI biosample generation
     """
+    with PROFILER.stage("merge_biosample_dfs", gisaidup.shape[0]):
+        return _merge_biosample_dfs(ncbiup, gisaidup, gisaidjson, bioproject,
+                                    unknown, organism, host, host_disease)
+
+
+def _merge_biosample_dfs(ncbiup, gisaidup, gisaidjson, bioproject, unknown,
+                         organism, host, host_disease):
+    if gisaidup.empty:
+        # e.g. nothing new since the ledger
+        return pd.DataFrame(columns=ncbiup.columns)
     # 1 get the epi numbers from gisaidjson into gisaidup
     ncbi = gisaidup.join(gisaidjson[["covv_accession_id"]])
     headers_NCBI_template = list(ncbiup.columns.values)
     for header in headers_NCBI_template:
         ncbi[header] = pd.Series()
-    ncbi['sample_title'] = ncbi[["covv_accession_id"]].apply(lambda x: f"SARS-CoV-2 {x.name.split('/')[2]}" if x.isnull().any().any() else f"SARS-Cov-2 {x.name.split('/')[2]} (GISAID {x.values[0]})", axis=1)
+    isolate = pd.Series(ncbi.index, index=ncbi.index).str.split('/').str[2]
+    accession = ncbi["covv_accession_id"]
+    ncbi['sample_title'] = np.where(accession.isnull(),
+                                    "SARS-CoV-2 " + isolate,
+                                    "SARS-Cov-2 " + isolate + " (GISAID " +
+                                    as_text(accession) + ")")
     # 2 get and keep the headers for column order at end of table build
     ncbi["bioproject_accession"] = bioproject
     ncbi["*organism"] = organism
-    ncbi["isolate"] = ncbi[["covv_accession_id"]].apply(lambda x: f"{x.name.split('/')[2]}", axis=1)
-    ncbi["description"] = ncbi[["covv_accession_id"]].apply(lambda x: f"{unknown}" if x.isnull().any().any() else f"{x.values[0]}", axis=1)
-    ncbi["*collected_by"] = ncbi[["covv_orig_lab"]].apply(lambda x: f"{x.values[0]}", axis=1)
-    ncbi["*collection_date"] = ncbi[["covv_collection_date"]].apply(lambda x: f"'{x.values[0]}", axis=1)
-    ncbi["*geo_loc_name"] = ncbi[["covv_location"]].apply(lambda x: f"{unknown}" if x.isnull().any().any() else f"{': '.join(x.values[0].split('/')[1:3])}", axis=1)
+    ncbi["isolate"] = isolate
+    ncbi["description"] = _or_unknown(accession, unknown)
+    ncbi["*collected_by"] = as_text(ncbi["covv_orig_lab"])
+    ncbi["*collection_date"] = "'" + as_text(ncbi["covv_collection_date"])
+    location = ncbi["covv_location"]
+    # an all-empty column is read as float64, which has no .str
+    ncbi["*geo_loc_name"] = location.astype(object).str.split('/') \
+                                    .str[1:3].str.join(': ') \
+                                    .where(location.notnull(), unknown)
     ncbi["*host"] = host
     ncbi["*host_disease"] = host_disease
     ncbi["*isolation_source"] = unknown
     ncbi["*lat_lon"] = unknown
-    ncbi["host_age"] = ncbi[["covv_patient_age"]].apply(lambda x: f"{unknown}" if x.isnull().any().any() else f"{x.values[0]}", axis=1)
-    ncbi["host_sex"] = ncbi[["covv_gender"]].apply(lambda x: f"{unknown}" if x.isnull().any().any() else f"{x.values[0]}", axis=1)
+    ncbi["host_age"] = _or_unknown(ncbi["covv_patient_age"], unknown)
+    ncbi["host_sex"] = _or_unknown(ncbi["covv_gender"], unknown)
     ncbi["*sample_name"] = ncbi.index.values
-    ncbi["passage_history"] = ncbi[["covv_passage"]].apply(lambda x: f"{unknown}" if x.isnull().any().any() else f"{x.values[0]}", axis=1)
+    ncbi["passage_history"] = _or_unknown(ncbi["covv_passage"], unknown)
     ncbi2 = ncbi[headers_NCBI_template]
     return ncbi2
+
+
+def as_text(series):
+    """str() of each value, as the row-wise f-strings gave (NaN is 'nan')."""
+    text = series.astype(object).astype(str)
+    missing = text.isnull()
+    if missing.any():
+        text[missing] = series[missing].map(str)
+    return text
+
+
+def _or_unknown(series, unknown):
+    """str() of each value, with missing values replaced by unknown."""
+    return as_text(series).where(series.notnull(), unknown)
@@ -0,0 +1,85 @@
+"""
+    This module writes the output tables as a single tab-delimited stream.
+
+    Merge SARS-CoV-2 *.xls, *.xlsx and *.json files for NCBI biosample upload.
+    Merge tables for SRA sample upload.
+    Copyright (C) 2020 Dr Mark B Schultz dr.mark.schultz@gmail.com
+    https://github.com/schultzm/gnb.git GNU Affero General Public License
+    <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import io
+import sys
+
+
+class TSVWriter():
+    """Write one or more DataFrames to stdout or path as one TSV.
+
+    The header is written once, from the first DataFrame; later
+    DataFrames must have the same columns.  Rows are rendered block_size
+    at a time straight to the output, so the rendered text is never held
+    in memory.  Output is gzipped if compress is set or path ends in .gz.
+    """
+    def __init__(self, path=None, block_size=1000, compress=None,
+                 index=False, index_label=None, buffer_bytes=1 << 20):
+        self.path        = path
+        self.block_size  = block_size
+        self.compress    = compress if compress is not None else \
+                           str(path).endswith(".gz")
+        self.index       = index
+        self.index_label = index_label
+        self.buffer_bytes = buffer_bytes
+        self.columns     = None
+        self.handle      = None
+        self._close      = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self.path is None:
+            if self.compress:
+                raw = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+                self._close.append(raw)
+                self.handle = io.TextIOWrapper(raw, encoding="utf-8",
+                                               newline="")
+                self._close.insert(0, self.handle)
+            else:
+                self.handle = sys.stdout
+        elif self.compress:
+            self.handle = gzip.open(self.path, "wt", encoding="utf-8",
+                                    newline="")
+            self._close.append(self.handle)
+        else:
+            self.handle = open(self.path, "w", encoding="utf-8", newline="",
+                               buffering=self.buffer_bytes)
+            self._close.append(self.handle)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.flush()
+        for handle in self._close:
+            handle.close()
+        self._close  = []
+        self.handle  = None
+
+    def write(self, df):
+        """Append the rows of df to the output."""
+        if self.handle is None:
+            self.open()
+        header = self.columns is None
+        if header:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            extra = [col for col in df.columns if col not in self.columns]
+            if extra:
+                raise ValueError("Columns not in the header already "
+                                 f"written: {', '.join(map(str, extra))}")
+            df = df.reindex(columns=self.columns)
+        df.to_csv(self.handle, sep="\t", header=header, index=self.index,
+                  index_label=self.index_label, chunksize=self.block_size)
@@ -38,6 +38,7 @@ setup(
     install_requires = ["pandas>=0.25.3",
                         "xlrd>=1.0.0"],
     extras_require={"test": ["pytest", "pytest-cov"],
+                    "zstd": ["zstandard"],
     },
     package_data={"": ["*.xlsx", "*.xls", "*.json", "*.tsv"]},
     entry_points={"console_scripts": ["gnb = gnb.__main__:main"]},